@@ -4,9 +4,16 @@ from Pytorch.Grid.Grid_Layout import GRID_Layout
 
 
 class GRID_Layout_GAM(GRID_Layout):
+    # if True, the bspline design matrices are torch sparse tensors
+    sparse = False
+    # if True, the training design is evaluated per minibatch (SG samplers only)
+    stream = False
+
     def set_up_data(self, n, n_val, model_param, batch_size):
         from torch.utils.data import TensorDataset, DataLoader
-        from Pytorch.Util.Util_bspline import get_design
+        from Pytorch.Util.Util_bspline import BasisTransformer
+        from Pytorch.Util.Util_Sparse import SparseTensorDataset, to_sparse_tensor
+        from Pytorch.Util.Util_Data import BsplineStream, FullBatch
 
         if 'no_in' in self.model_param.keys():
             no_in = self.model_param['no_in']
@@ -17,24 +24,50 @@ class GRID_Layout_GAM(GRID_Layout):
         X = X_dist.sample(torch.Size([n])).view(n, )
         X_val = X_dist.sample(torch.Size([n_val])).view(n_val, )
 
-        Z = torch.tensor(get_design(X.numpy(), degree=2, no_basis=model_param['no_basis']),
-                         dtype=torch.float32, requires_grad=False)
-        Z_val = torch.tensor(get_design(X_val.numpy(), degree=2, no_basis=model_param['no_basis']),
-                             dtype=torch.float32, requires_grad=False)
-
-        self.data = Z,
-        self.data_val = Z_val,
+        # the knots are fixed on the (first) training data; continuation runs reuse them
+        if self.model.basis is None:
+            self.model.basis = BasisTransformer(degree=2, no_basis=model_param['no_basis']).fit(X.numpy())
+
+        to_tensor = to_sparse_tensor if self.sparse else \
+            lambda Z: torch.tensor(Z, dtype=torch.float32, requires_grad=False)
+
+        Z_val = to_tensor(self.model.basis.transform(X_val.numpy(), sparse=self.sparse))
+        y_val = self.model.likelihood(Z_val).sample()
+
+        if self.stream:
+            # the training design is never materialized: y is sampled chunkwise
+            # and the minibatches' designs are evaluated on demand
+            y = torch.cat([self.model.likelihood(to_tensor(Z)).sample()
+                           for Z in self.model.basis.transform_chunks(X.numpy(), sparse=self.sparse)])
+            self.data = X, y
+
+            trainset = BsplineStream(X, y, self.model.basis, batch_size=batch_size, sparse=self.sparse)
+            self.trainloader = DataLoader(trainset, batch_size=None, num_workers=0)
+
+        else:
+            Z_np = self.model.basis.transform(X.numpy(), sparse=self.sparse)
+            Z = to_tensor(Z_np)
+            y = self.model.likelihood(Z).sample()
+            self.data = Z, y
+
+            if batch_size == n and self.model.linear_gaussian:
+                # full batch: the sufficient statistics apply to the very tensors of
+                # self.data (see Hidden.uses_suff_stat)
+                trainset = FullBatch(*self.data)
+                self.trainloader = DataLoader(trainset, batch_size=len(trainset), num_workers=0,
+                                              collate_fn=trainset.collate)
+                self.model.sufficient_statistics(*self.data)
+            elif self.sparse:
+                trainset = SparseTensorDataset(Z_np, y)
+                self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0,
+                                              collate_fn=trainset.collate)
+            else:
+                trainset = TensorDataset(*self.data)
+                self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0)
 
-        y = self.model.likelihood(*self.data).sample()
-        y_val = self.model.likelihood(*self.data_val).sample()
-
-        self.data = Z, y
         self.data_val = Z_val, y_val
         self.data_plot = X_val, y_val
 
-        trainset = TensorDataset(*self.data)
-        self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0)
-
         self.val_logprob = self.model.log_prob(*self.data_val)
         with torch.no_grad():
             self.val_MSE = torch.nn.MSELoss()(
@@ -42,9 +75,16 @@ class GRID_Layout_GAM(GRID_Layout):
 
 
 class GRID_Layout_STRUCTURED(GRID_Layout):
+    # if True, the bspline design matrices are torch sparse tensors
+    sparse = False
+    # if True, the training design is evaluated per minibatch (SG samplers only)
+    stream = False
+
     def set_up_data(self, n, n_val, model_param, batch_size):
         from torch.utils.data import TensorDataset, DataLoader
-        from Pytorch.Util.Util_bspline import get_design
+        from Pytorch.Util.Util_bspline import BasisTransformer
+        from Pytorch.Util.Util_Sparse import SparseTensorDataset, to_sparse_tensor
+        from Pytorch.Util.Util_Data import BsplineStream
 
         no_in = self.model_param['hunits'][0]
 
@@ -53,24 +93,45 @@ class GRID_Layout_STRUCTURED(GRID_Layout):
         X_val = X_dist.sample(torch.Size([n_val])).view(n_val, no_in)
 
         # explicit assumption that only the first variable is shrunken
-        Z = torch.tensor(get_design(X[:, 0].numpy(), degree=2, no_basis=model_param['no_basis']),
-                         dtype=torch.float32, requires_grad=False)
-        Z_val = torch.tensor(get_design(X_val[:, 0].numpy(), degree=2, no_basis=model_param['no_basis']),
-                             dtype=torch.float32, requires_grad=False)
-
-        self.data = X, Z
-        self.data_val = X_val, Z_val,
+        # the knots are fixed on the (first) training data; continuation runs reuse them
+        if self.model.basis is None:
+            self.model.basis = BasisTransformer(degree=2, no_basis=model_param['no_basis']).fit(X[:, 0].numpy())
+
+        to_tensor = to_sparse_tensor if self.sparse else \
+            lambda Z: torch.tensor(Z, dtype=torch.float32, requires_grad=False)
+
+        Z_val = to_tensor(self.model.basis.transform(X_val[:, 0].numpy(), sparse=self.sparse))
+        y_val = self.model.likelihood(X_val, Z_val).sample()
+
+        if self.stream:
+            # the training design is never materialized: y is sampled chunkwise
+            # and the minibatches' designs are evaluated on demand
+            chunk_size = 10000
+            chunks = self.model.basis.transform_chunks(X[:, 0].numpy(), chunk_size, sparse=self.sparse)
+            y = torch.cat([self.model.likelihood(X[i * chunk_size:(i + 1) * chunk_size], to_tensor(Z)).sample()
+                           for i, Z in enumerate(chunks)])
+            self.data = X, y
+
+            trainset = BsplineStream(X, y, self.model.basis, column=0, batch_size=batch_size, sparse=self.sparse)
+            self.trainloader = DataLoader(trainset, batch_size=None, num_workers=0)
+
+        else:
+            Z_np = self.model.basis.transform(X[:, 0].numpy(), sparse=self.sparse)
+            Z = to_tensor(Z_np)
+            y = self.model.likelihood(X, Z).sample()
+            self.data = X, Z, y
+
+            if self.sparse:
+                trainset = SparseTensorDataset(X, Z_np, y)
+                self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0,
+                                              collate_fn=trainset.collate)
+            else:
+                trainset = TensorDataset(*self.data)
+                self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0)
 
-        y = self.model.likelihood(*self.data).sample()
-        y_val = self.model.likelihood(*self.data_val).sample()
-
-        self.data = X, Z, y
         self.data_val = X_val, Z_val, y_val
         self.data_plot = X_val, Z_val, y_val
 
-        trainset = TensorDataset(*self.data)
-        self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0)
-
         self.val_logprob = self.model.log_prob(*self.data_val)
         with torch.no_grad():
             self.val_MSE = torch.nn.MSELoss()(
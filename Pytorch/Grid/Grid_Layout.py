@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 from Pytorch.Grid.Util.Grid_Tracker import Grid_Tracker
 from Pytorch.Grid.Util.Continuation import Continuation
 from Pytorch.Grid.Util.Sampler_set_up import Sampler_set_up
+from Pytorch.Util.Util_Distribution import set_validate_args
 import pickle
 
 
@@ -38,13 +39,21 @@ class GRID_Layout(Grid_Tracker, Continuation, Sampler_set_up):
         for tensor in [*self.data, *self.data_val]:
             tensor.to(self.device)
 
-        self.set_up_sampler(sampler_name, sampler_param)
+        # model & data are set up (and validated): skip the argument checks of the
+        # distributions, which the samplers rebuild in every step
+        validate = set_validate_args(False)
+        try:
+            self.set_up_sampler(sampler_name, sampler_param)
+        finally:
+            set_validate_args(validate)
         metrics = self.evaluate_model()  # *self.data_val FIXME
 
         # for restoration of the model, it needs to be reinstantiated
         # and loaded the state dict upon
         self.config['true_model'] = self.model.true_model
         self.config['init_model'] = self.model.init_model
+        if getattr(self.model, 'basis', None) is not None:
+            self.config['basis'] = self.model.basis.state_dict()
         with open(self.basename + '_config.pkl', 'wb') as handle:
             pickle.dump(self.config, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
@@ -65,6 +74,7 @@ class GRID_Layout(Grid_Tracker, Continuation, Sampler_set_up):
 
     def set_up_data(self, n, n_val, model_param, batch_size):
         from torch.utils.data import TensorDataset, DataLoader
+        from Pytorch.Util.Util_Data import FullBatch
 
         if 'no_in' in self.model_param.keys():
             no_in = self.model_param['no_in']
@@ -87,8 +97,17 @@ class GRID_Layout(Grid_Tracker, Continuation, Sampler_set_up):
         self.data_val = X_val, y_val
         self.data_plot = X_val, y_val
 
-        trainset = TensorDataset(*self.data)
-        self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0)
+        # full batch samplers evaluate the likelihood on the training data only:
+        # linear gaussian models reduce to its sufficient statistics, which apply
+        # to the very tensors of self.data (see Hidden.uses_suff_stat)
+        if batch_size == n and getattr(self.model, 'linear_gaussian', False):
+            trainset = FullBatch(*self.data)
+            self.trainloader = DataLoader(trainset, batch_size=len(trainset), num_workers=0,
+                                          collate_fn=trainset.collate)
+            self.model.sufficient_statistics(*self.data)
+        else:
+            trainset = TensorDataset(*self.data)
+            self.trainloader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=0)
 
         self.val_logprob = self.model.log_prob(*self.data_val)
         with torch.no_grad():
@@ -0,0 +1,56 @@
+import torch
+import torch.nn as nn
+import torch.distributions as td
+from timeit import timeit
+
+from Pytorch.Models.BNN import BNN
+from Pytorch.Layer.GAM import GAM
+from Pytorch.Util.Util_bspline import get_design
+
+# steps/sec of a sampler's gradient evaluation (log_prob & backward), eager vs.
+# compiled (Util_Model.compile_log_prob) on the Suit_BNN & Suit_GAM configurations
+
+# (CONFIG) ---------------------------------------------------------------------
+n = 1000  # full batch (RHMC, MALA)
+batch = 100  # SG samplers
+steps = 2000
+warmup = 50
+
+suits = {
+    'Suit_BNN': (BNN, dict(hunits=[2, 10, 5, 1], activation=nn.ReLU(),
+                           final_activation=nn.Identity(),
+                           prior='normal',
+                           heteroscedast=False)),
+    'Suit_GAM': (GAM, dict(xgrid=(0, 10, 0.5), order=1, no_basis=20, no_out=1,
+                           activation=nn.Identity(), bijected=True))}
+
+
+def data(model, n):
+    if isinstance(model, GAM):
+        X = td.Uniform(0., 10.).sample([n])
+        X = torch.tensor(get_design(X.numpy(), degree=2, no_basis=model.no_basis), dtype=torch.float32)
+    else:
+        X = td.Uniform(-10., 10.).sample([n, model.hunits[0]])
+    return X, model.likelihood(X).sample()
+
+
+def steps_per_sec(model, X, y):
+    step = lambda: model.log_prob(X, y).backward()
+    timeit(step, number=warmup)
+    return steps / timeit(step, number=steps)
+
+
+for name, (cls, model_param) in suits.items():
+    model = cls(**model_param)
+    for size in (n, batch):
+        X, y = data(model, size)
+
+        model.decompile_log_prob()
+        eager = steps_per_sec(model, X, y)
+
+        model.compile_log_prob(X, y)
+        compiled = steps_per_sec(model, X, y)
+        model.decompile_log_prob()
+
+        print('{} (batch {}): eager {:.0f} steps/sec, compiled {:.0f} steps/sec, speedup {:.2f}'.format(
+            name, size, eager, compiled, compiled / eager))
@@ -6,6 +6,8 @@ from tqdm import tqdm
 
 from Pytorch.Layer import GAM, Hidden, Group_HorseShoe
 from Pytorch.Models import BNN, ShrinkageBNN, StructuredBNN
+from Pytorch.Util.Util_bspline import BasisTransformer
+from Pytorch.Util.Util_Distribution import set_validate_args
 
 
 class Continuation:
@@ -233,6 +235,9 @@ class Continuation:
         self.model.load_state_dict(true_model)
         if hasattr(self.model, 'vec'):
             self.model.true_vec = self.model.vec
+        if 'basis' in config.keys():
+            # continue on the knots of the original run
+            self.model.basis = BasisTransformer().load_state_dict(config['basis'])
         self.set_up_data(self.n, self.n_val, model_param, batch_size)
         try:
             self.model.load_state_dict(
@@ -243,7 +248,11 @@ class Continuation:
                 torch.load(self.oldpathresults + '/' + model_name + '_/' + model_name_base + '.model'))
         self.model.plot(*self.data_plot, path=self.basename + '_initmodel', title='')
 
-        self.set_up_sampler(sampler_name, sampler_param)
+        validate = set_validate_args(False)  # see GRID_Layout.main
+        try:
+            self.set_up_sampler(sampler_name, sampler_param)
+        finally:
+            set_validate_args(validate)
         # import random
         # self.sampler.model.plot(*self.data_plot, random.sample(self.sampler.chain, plot_subsample),
         #                         path=self.basename + '_datamodel_random', title='')
@@ -51,6 +51,20 @@ class Sampler_set_up:
             self.sampler = Sampler(self.model, **sampler_param)
             self.sampler.sample(self.trainloader, burn_in, n_samples)
 
+        elif sampler_name == 'Gibbs':  # conjugate GAM (full batch)
+            from Pytorch.Samplers.Gibbs import Gibbs_GAM
+            n_samples = sampler_param.pop('n_samples')
+            burn_in = sampler_param.pop('burn_in')
+            self.sampler = Gibbs_GAM(self.model, **sampler_param)
+            self.sampler.sample(self.trainloader, burn_in, n_samples)
+
+        elif sampler_name == 'MwG':  # shrinkage layers' hyperparameters (full batch)
+            from Pytorch.Samplers.Gibbs import Metropolis_within_Gibbs
+            n_samples = sampler_param.pop('n_samples')
+            burn_in = sampler_param.pop('burn_in')
+            self.sampler = Metropolis_within_Gibbs(self.model, **sampler_param)
+            self.sampler.sample(self.trainloader, burn_in, n_samples)
+
         else:
             raise ValueError('sampler_name was not correctly specified')
 
@@ -121,3 +135,11 @@ class Sampler_set_up:
     def grid_exec_SGRLD(self, steps, batch_size, epsilons=np.arange(0.0001, 0.03, 0.003)):
         for epsilon in epsilons:
             yield dict(epsilon=epsilon, n_samples=steps, burn_in=int(steps * 0.10), batch_size=batch_size)
+
+    def grid_exec_Gibbs(self, steps):
+        """Gibbs_GAM has no tuning parameters: a single configuration"""
+        yield dict(n_samples=steps, burn_in=int(steps * 0.10))
+
+    def grid_exec_MwG(self, steps, epsilons=np.arange(0.0001, 0.03, 0.003), Ls=[1, 2, 3, 5, 10]):
+        """Metropolis_within_Gibbs: epsilon & L of the weights' HMC move"""
+        return self.grid_exec_RHMC(steps, epsilons, Ls)
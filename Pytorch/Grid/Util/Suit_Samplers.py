@@ -123,3 +123,43 @@ def samplers(cls, cls_Grid, n, n_val, model_param, steps, batch, epsilons, Ls, s
     #             n=n, n_val=n_val,
     #             model_class=cls, model_param=model_param,
     #             sampler_name='MALA', sampler_param=config_copy)
+
+    # (6) Gibbs -------------------------------------------------
+    # conjugate GAM posterior: exact block updates, no epsilon x L grid
+    from Pytorch.Layer.GAM import GAM
+    from Pytorch.Layer.GAM_banded import GAM_banded
+    if cls in (GAM, GAM_banded):
+        run = samp_name + '_Gibbs' + '_' + name
+        root = rooting(run)
+
+        bnn_unittest = cls_Grid(root)
+        prelim_configs = bnn_unittest.grid_exec_Gibbs(steps=steps)
+
+        for config in prelim_configs:
+            for i in range(repeated):
+                config_copy = {key: deepcopy(value) for key, value in config.items()}
+                bnn_unittest.main(
+                    seperated=seperated,
+                    n=n, n_val=n_val,
+                    model_class=cls, model_param=model_param,
+                    sampler_name='Gibbs', sampler_param=config_copy)
+
+    # (7) MwG -------------------------------------------------
+    # exact hyperparameter draws for models with shrinkage layers (e.g. Group_lasso),
+    # whose hyperparameters enter the prior only (see Util_Model.prior_conditionals)
+    layer = cls.shrinkage_type[model_param.get('shrinkage', 'ghorse')] if hasattr(cls, 'shrinkage_type') else cls
+    if cls.prior_conditionals and getattr(layer, 'conditionals', ()):
+        run = samp_name + '_MwG' + '_' + name
+        root = rooting(run)
+
+        bnn_unittest = cls_Grid(root)
+        prelim_configs = bnn_unittest.grid_exec_MwG(steps=steps, epsilons=epsilons, Ls=Ls)
+
+        for config in prelim_configs:
+            for i in range(repeated):
+                config_copy = {key: deepcopy(value) for key, value in config.items()}
+                bnn_unittest.main(
+                    seperated=seperated,
+                    n=n, n_val=n_val,
+                    model_class=cls, model_param=model_param,
+                    sampler_name='MwG', sampler_param=config_copy)
@@ -1,3 +1,4 @@
+import math
 import torch
 import torch.distributions as td
 import torch.nn as nn
@@ -5,8 +6,10 @@ from copy import deepcopy
 
 from Pytorch.Layer.Hidden import Hidden
 from Pytorch.Util.Util_Distribution import LogTransform
+from Pytorch.Util.Util_Prior import gamma_grad, bijected_grad
 
-from Pytorch.Util.Util_bspline import get_design, diff_mat1D
+from Pytorch.Util.Util_bspline import get_design, diff_mat1D, banded_eigh
+from Pytorch.Util.Util_Sparse import to_sparse_tensor
 
 
 class GAM(Hidden):
@@ -16,6 +19,8 @@ class GAM(Hidden):
         RandomWalk Prior Model on Gamma (W) vector.
         Be carefull to transform the Data beforehand with some DeBoor Style algorithm.
         This Module mereley implements the Hidden behaviour + Random Walk Prior
+        The design may be a torch sparse tensor (see Util_Sparse.to_sparse_tensor),
+        in which case forward only touches the non-zero elements of each row.
         :param no_basis: number of basis from the de boor basis expansion to expect (=no_columns of X)
         which is in fact the no_in of Hidden.
         :param order: difference order to create the Precision (/Penalty) matrix K
@@ -27,18 +32,36 @@ class GAM(Hidden):
 
         Hidden.__init__(self, no_basis, no_out, bias=False, activation=activation)
 
+        # fitted Util_bspline.BasisTransformer of the training data. If available,
+        # it is used to transform new data (e.g. in plot) on the same knots
+        self.basis = None
+
     def define_proper_cov(self):
         # replace the numerical zero eigenvalue by fraction*(smallest non-zero eigenval)
         # to ensure a propper distribution (see Marra Wood or Wood JAGS)
         threshold = 1e-3
         fraction = 1e-1
-        self.K = torch.tensor(diff_mat1D(self.no_basis, self.order)[1], dtype=torch.float32, requires_grad=False)
-        val, vec = torch.eig(self.K, eigenvectors=True)
-        eig_val_2nd = torch.sort(val, axis=0).values[1, :]
-        val[val[:, 0] < threshold, :] = eig_val_2nd * fraction
-        self.penK = vec @ torch.diag(val[:, 0]) @ vec.t()
+        # K is banded (bandwidth order): keep it sparse and solve the banded eigen problem
+        K = diff_mat1D(self.no_basis, self.order, sparse=True)[1]
+        self.K = to_sparse_tensor(K)
+        val, vec = banded_eigh(K, self.order)  # ascending eigenvalues
+        replaced = val < threshold
+        # penK = K + null_vec diag(null_val) null_vec^T, i.e. the banded K plus a
+        # low rank correction of the replaced eigenvalues (see Gibbs_GAM)
+        self.null_vec = torch.tensor(vec[:, replaced], dtype=torch.float32)
+        self.null_val = torch.tensor(val[1] * fraction - val[replaced], dtype=torch.float32)
+        val[replaced] = val[1] * fraction
+        val = torch.tensor(val, dtype=torch.float32)
+        vec = torch.tensor(vec, dtype=torch.float32)
+        self.penK = vec @ torch.diag(val) @ vec.t()
         self.cov = torch.inverse(self.penK).detach()
 
+        # factorize once: W's covariance tau² * cov merely changes in scale,
+        # which prior_log_prob accounts for analytically
+        self.penK_chol = torch.cholesky(self.penK).detach()  # penK = L L^T
+        self.penK_logdet = 2 * torch.log(torch.diag(self.penK_chol)).sum()
+        self.cov_chol = torch.cholesky(self.cov).detach()
+
     def define_model(self):
         # setting up a proper covariance for W's random walk prior
         self.define_proper_cov()
@@ -49,15 +72,18 @@ class GAM(Hidden):
 
         if self.bijected:
             self.tau.dist = td.TransformedDistribution(self.tau.dist, LogTransform())
-            self.tau.data = self.tau.dist.sample()
-            self.tau_bij = self.tau.dist.transforms[0]._inverse(self.tau)
-            self.W.dist = td.MultivariateNormal(torch.zeros(self.no_basis),
-                                                self.tau_bij ** 2 * self.cov)
+        self.dist_parents = {'tau_bij': ('tau',)} if self.bijected else {}
 
-        else:
-            self.tau.data = self.tau.dist.sample()  # to ensure dist W is set up properly
-            self.W.dist = td.MultivariateNormal(torch.zeros(self.no_basis),
-                                                self.tau ** 2 * self.cov)
+        self.tau.data = self.tau.dist.sample()  # to ensure dist W is set up properly
+        self.update_distributions()
+
+    def W_dist(self):
+        """W's random walk prior distribution given the current tau. Notice,
+        that it is required for sampling W only, prior_log_prob does not
+        construct it."""
+        tau = self.tau_bij if self.bijected else self.tau
+        return td.MultivariateNormal(torch.zeros(self.no_basis),
+                                     scale_tril=tau.detach() * self.cov_chol)
 
     def update_distributions(self):
         # tau_bij is the actual variance parameter of W (on R+)- whilest if self.bijected==True,
@@ -66,18 +92,9 @@ class GAM(Hidden):
             # here tau (is on R) ---> tau_bij (on R+)
             self.tau_bij = self.tau.dist.transforms[0]._inverse(self.tau)
 
-            try:
-                self.W.dist = td.MultivariateNormal(torch.zeros(self.no_basis),
-                                                    self.tau_bij ** 2 * self.cov)
-            except Exception as e:
-                print(self.tau_bij)
-                print(self.tau_bij * self.cov)
-                raise RuntimeError('GAM_update: cannot update distribution, as covariance is invalid:\n'
-                                   'tau:{}\ntau_bij:{}\ncov:{}'.format(self.tau, self.tau_bij,
-                                                                       self.tau_bij ** 2 * self.cov))
-        else:
-            self.W.dist = td.MultivariateNormal(torch.zeros(self.no_basis),
-                                                self.tau ** 2 * self.cov)
+    def penalty(self, W):
+        """quadratic form W^T penK W (columnwise) based on the cached cholesky of penK"""
+        return ((self.penK_chol.t() @ W) ** 2).sum(-2)
 
     def reset_parameters(self, tau=None):
         """
@@ -102,7 +119,8 @@ class GAM(Hidden):
             self.tau.data = tau
         self.update_distributions()
 
-        self.W.data = self.W.dist.sample().view(self.no_basis, 1)
+        self.W.dist = self.W_dist()
+        self.W.data = self.W.dist.sample().view(-1, self.no_basis).t()
 
         # gamma = torch.cat(
         #     [td.Uniform(torch.tensor([-1.]), torch.tensor([1.])).sample(),
@@ -126,11 +144,55 @@ class GAM(Hidden):
         # return sum(const + kernel + self.tau.dist.log_prob(self.tau))  # notice that tau can be on R if
         # # self.bijected is true!
 
-        return sum(self.W.dist.log_prob(self.W)) + self.tau.dist.log_prob(self.tau)
+        # W ~ MVN(0, tau² * penK^-1) with cached cholesky L of penK:
+        # log-det shift k * log(tau²) - log|penK| & quadratic form ||L^T W||² / tau²
+        tau = self.tau_bij if self.bijected else self.tau
+        const = - 0.5 * self.no_basis * math.log(2 * math.pi) + 0.5 * self.penK_logdet \
+                - self.no_basis * torch.log(tau)
+        kernel = - 0.5 * tau ** -2 * self.penalty(self.W)
+
+        return (const + kernel).sum() + self.tau.dist.log_prob(self.tau)
+
+    def prior_log_prob_stacked(self, states):
+        """:return: prior_log_prob of K stacked states: Tensor of shape (K, )"""
+        tau = states['tau']
+        if self.bijected:
+            tau = self.tau.dist.transforms[0]._inverse(tau)
+        const = - 0.5 * self.no_basis * math.log(2 * math.pi) + 0.5 * self.penK_logdet \
+                - self.no_basis * torch.log(tau)
+        kernel = - 0.5 * tau ** -2 * self.penalty(states['W'])
+
+        return (const + kernel).sum(-1) + self.tau.dist.log_prob(states['tau']).sum(-1)
+
+    # ANALYTIC GRADIENTS: see Util_Model.log_prob_and_grad
+    @property
+    def analytic_layer(self):
+        return type(self.activation) in self.activation_grads and \
+               type(self).forward is Hidden.forward and \
+               type(self).prior_log_prob is GAM.prior_log_prob and \
+               type(self).penalty is GAM.penalty
+
+    def prior_grad(self):
+        """gradients of prior_log_prob wrt. W & tau; i.e. tau^-2 penK W and the
+        derivatives of the log-det shift, quadratic form & tau's prior"""
+        tau = self.tau_bij if self.bijected else self.tau
+        P = self.penK_chol.t() @ self.W
+        g_tau = - self.no_basis * self.no_out / tau + tau ** -3 * (P ** 2).sum()
+
+        if self.bijected:
+            dist = self.tau.dist.base_dist
+            g_tau = g_tau * tau + bijected_grad(gamma_grad, self.tau, dist.concentration, dist.rate)
+        else:
+            dist = self.tau.dist
+            g_tau = g_tau + gamma_grad(self.tau, dist.concentration, dist.rate)
+
+        return {'tau': g_tau.sum_to_size(self.tau.shape), 'W': - tau ** -2 * self.penK_chol @ P}
 
     def plot(self, X, y, chain=None, path=None, title='', **kwargs):
-        Z = torch.tensor(get_design(X.numpy(), degree=2, no_basis=self.no_basis), dtype=torch.float32,
-                         requires_grad=False)
+        if self.basis is not None:
+            Z = to_sparse_tensor(self.basis.transform(X.numpy(), sparse=True))
+        else:
+            Z = to_sparse_tensor(get_design(X.numpy(), degree=2, no_basis=self.no_basis, sparse=True))
         df0 = self.predict_states(chain, Z)
 
         df0['X'] = X.view(X.shape[0], ).numpy()
@@ -175,6 +237,20 @@ if __name__ == '__main__':
     gam.true_vec = gam.vec
     y = gam.likelihood(Z).sample()
 
+    # incremental refresh_distributions: a log_prob under grad mode, which follows
+    # a no_grad one (e.g. a sampler's logging) must not reuse the graph free tau_bij
+    gam.use_analytic_grad = False
+    with torch.no_grad():
+        gam.log_prob(Z, y)
+    gam.log_prob(Z, y).backward()
+    grad = gam.tau.grad.clone()
+    gam.zero_grad()
+    gam.update_distributions()
+    gam.log_prob(Z, y).backward()
+    assert torch.allclose(grad, gam.tau.grad), 'stale distributions after no_grad log_prob'
+    gam.zero_grad()
+    gam.use_analytic_grad = True
+
     # flexible GAM
     gam.reset_parameters(tau=torch.tensor([-1.]))
     gam.init_model = deepcopy(gam.state_dict())
@@ -0,0 +1,113 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from copy import deepcopy
+
+from Pytorch.Layer.GAM import GAM
+from Pytorch.Util.Util_bspline import diff_mat1D, diff_coef, banded_eigh, get_design2D
+
+
+class GAM2D(GAM):
+    def __init__(self, xgrid=(0, 10, 0.5), order=2, no_basis=20, no_out=1,
+                 activation=nn.Identity(), bijected=True):
+        """
+        Bivariate tensor product smooth with the RandomWalk Prior of diff_mat2D:
+        gamma^T K gamma = gamma^T (I kron K1 + K1 kron I) gamma, which is
+        never materialized: with G = W.view(no_basis, no_basis), the penalty is
+        ||G D^T||² + ||D G||² and K's eigenvalues are the pairwise sums of K1's
+        eigenvalues.
+        The design is expected as the stacked marginal designs Z of shape
+        (n, 2, no_basis) (see Util_bspline.get_design2D), such that the forward
+        pass is a rowwise kronecker product: f(Z)_i = Z1_i^T G Z2_i.
+
+        :param no_basis: number of basis functions per axis; the layer has
+        no_basis² coefficients per output.
+        for the remaining params see GAM
+        """
+        self.dim = no_basis
+        GAM.__init__(self, xgrid, order, no_basis ** 2, no_out, activation, bijected)
+
+    def define_proper_cov(self):
+        # replace the nullspace's eigenvalues by fraction*(smallest non-zero eigenval)
+        # to ensure a propper distribution (see Marra Wood or Wood JAGS)
+        fraction = 1e-1
+
+        self.diff_coef = torch.tensor(diff_coef(self.order), dtype=torch.float32)
+
+        # eigen decomposition of the kronecker sum K from the 1d penalty K1:
+        # K = (V kron V) diag(val_a + val_b) (V kron V)^T
+        k1 = diff_mat1D(self.dim, self.order, sparse=True)[1]
+        val, vec = banded_eigh(k1, self.order)
+        val[:self.order] = 0.
+        val2D = val[:, None] + val[None, :]
+        val2D[:self.order, :self.order] = val[self.order] * fraction
+
+        self.eig_vec = torch.tensor(vec, dtype=torch.float32)
+        self.eig_val = torch.tensor(val2D, dtype=torch.float32)
+        self.penK_logdet = torch.tensor(np.sum(np.log(val2D)), dtype=torch.float32)
+
+        # penalty of K's nullspace: projection on the first order eigenvectors
+        self.null_val = float(val[self.order] * fraction)
+
+    def penalty(self, W):
+        """quadratic form W^T penK W (columnwise) via differences along both
+        axes of G and the (proper) penalty on K's nullspace"""
+        G = W.view(*W.shape[:-2], self.dim, self.dim, W.shape[-1])
+        m = self.dim - self.order
+        D1G = sum(c * G.narrow(-2, j, m) for j, c in enumerate(self.diff_coef))
+        D2G = sum(c * G.narrow(-3, j, m) for j, c in enumerate(self.diff_coef))
+
+        V0 = self.eig_vec[:, :self.order]
+        nullG = torch.einsum('ai,...abo,bj->...ijo', V0, G, V0)
+
+        return (D1G ** 2).sum((-3, -2)) + (D2G ** 2).sum((-3, -2)) + \
+               self.null_val * (nullG ** 2).sum((-3, -2))
+
+    def forward(self, Z):
+        """:param Z: Tensor of shape (n, 2, no_basis): stacked marginal designs"""
+        G = self.W.view(self.dim, self.dim, self.no_out)
+        return self.activation(torch.einsum('na,abo,nb->no', Z[:, 0], G, Z[:, 1]))
+
+    def forward_stacked(self, Z, states):
+        G = states['W'].view(-1, self.dim, self.dim, self.no_out)
+        return self.activation(torch.einsum('na,kabo,nb->kno', Z[:, 0], G, Z[:, 1]))
+
+    def reset_parameters(self, tau=None):
+        """
+        Sample the prior model, instantiating the data model
+        :param tau: if not None, it is the inverse variance (smoothness) of
+        randomwalkprior. If None, the self.dist_tau is used for sampling tau
+        :return: None. Inplace self.W, self.tau
+        """
+        if tau is None:
+            self.tau.data = self.tau.dist.sample()
+        else:
+            self.tau.data = tau
+        self.update_distributions()
+
+        # G = tau * V (E / sqrt(val2D)) V^T with E ~ N(0, I) has covariance tau² penK^-1
+        tau = self.tau_bij if self.bijected else self.tau
+        E = torch.randn(self.no_out, self.dim, self.dim) / self.eig_val.sqrt()
+        G = tau.detach() * self.eig_vec @ E @ self.eig_vec.t()
+        self.W.data = G.permute(1, 2, 0).reshape(self.no_basis, self.no_out)
+
+        self.init_model = deepcopy(self.state_dict())
+
+    def design(self, X):
+        """stacked marginal designs of X (n, 2) on the fitted basis (see GAM.basis)"""
+        if self.basis is not None:
+            Z = np.stack([self.basis.transform(X[:, j].numpy()) for j in range(2)], axis=1)
+        else:
+            Z = get_design2D(X.numpy(), degree=2, no_basis=self.dim)
+        return torch.tensor(Z, dtype=torch.float32)
+
+    def plot(self, X, y, chain=None, path=None, title='', **kwargs):
+        """surface of the true model, data & the current, init and chain's
+        predictions (see Util_plots.plot2d) on X of shape (n, 2)"""
+        df0 = self.predict_states(chain, self.design(X))
+        plt = self.plot2d(X, y, df0, title=title, **kwargs)
+
+        if path is None:
+            plt.show()
+        else:
+            plt.savefig('{}.pdf'.format(path), bbox_inches='tight')
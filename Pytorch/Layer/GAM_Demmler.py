@@ -0,0 +1,96 @@
+import torch
+import torch.nn as nn
+import torch.distributions as td
+from copy import deepcopy
+
+from Pytorch.Layer.GAM import GAM
+from Pytorch.Util.Util_Distribution import LogTransform
+from Pytorch.Util.Util_bspline import diff_mat1D, banded_eigh
+
+
+class GAM_Demmler(GAM):
+    def __init__(self, xgrid=(0, 10, 0.5), order=1, no_basis=20, no_out=1,
+                 activation=nn.Identity(), bijected=True, no_components=None):
+        """
+        Demmler-Reinsch reparametrization of GAM: with the eigen decomposition
+        penK = V diag(val) V^T, the gamma vector is
+        W = tau * V diag(val)^-1/2 U,   U ~ N(0, I)
+        i.e. the sampled parameters U are a priori independent and non-centered
+        in tau, which removes the strong correlation of W and its funnel with tau.
+        The eigenvectors are ordered by frequency, such that truncating to the
+        first no_components drops the wiggliest components of the smooth.
+
+        :param no_components: int or None. number of (low frequency) eigen
+        components to keep. None keeps all no_basis components.
+        for the remaining params see GAM
+        """
+        self.no_components = no_basis if no_components is None else no_components
+        GAM.__init__(self, xgrid, order, no_basis, no_out, activation, bijected)
+
+    def define_proper_cov(self):
+        # replace the nullspace's eigenvalues by fraction*(smallest non-zero eigenval)
+        # to ensure a propper distribution (see Marra Wood or Wood JAGS)
+        fraction = 1e-1
+        K = diff_mat1D(self.no_basis, self.order, sparse=True)[1]
+        val, vec = banded_eigh(K, self.order)  # ascending i.e. low frequency first
+        val[:self.order] = val[self.order] * fraction
+
+        r = self.no_components
+        self.eig_val = torch.tensor(val[:r], dtype=torch.float32)
+        self.eig_vec = torch.tensor(vec[:, :r], dtype=torch.float32)
+        self.scale = self.eig_vec / self.eig_val.sqrt()  # V diag(val)^-1/2
+
+    def define_model(self):
+        self.define_proper_cov()
+
+        self.tau = nn.Parameter(torch.Tensor(1))
+        self.tau.dist = td.Gamma(torch.tensor([2.]), torch.tensor([2.]))
+        if self.bijected:
+            self.tau.dist = td.TransformedDistribution(self.tau.dist, LogTransform())
+        self.dist_parents = {'tau_bij': ('tau',)} if self.bijected else {}
+
+        self.U = nn.Parameter(torch.Tensor(self.no_components, self.no_out))
+        self.U.dist = td.Normal(torch.zeros(self.no_components, self.no_out), 1.)
+
+        self.tau.data = self.tau.dist.sample()
+        self.update_distributions()
+
+    @property
+    def W(self):
+        """gamma vector in the original bspline basis"""
+        tau = self.tau.dist.transforms[0]._inverse(self.tau) if self.bijected else self.tau
+        return tau * self.scale @ self.U
+
+    def reset_parameters(self, tau=None):
+        """
+        Sample the prior model, instantiating the data model
+        :param tau: if not None, it is the inverse variance (smoothness) of
+        randomwalkprior. If None, the self.dist_tau is used for sampling tau
+        :return: None. Inplace self.U, self.tau
+        """
+        if tau is None:
+            self.tau.data = self.tau.dist.sample()
+        else:
+            self.tau.data = tau
+        self.update_distributions()
+
+        self.U.data = self.U.dist.sample()
+        self.init_model = deepcopy(self.state_dict())
+
+    def prior_log_prob(self):
+        """
+        returns: log_probability sum of U & tau. Since W is a deterministic
+        function of (U, tau), the random walk prior reduces to the standard normal on U.
+        """
+        return self.U.dist.log_prob(self.U).sum() + self.tau.dist.log_prob(self.tau)
+
+    def forward_stacked(self, Z, states):
+        tau = states['tau']
+        if self.bijected:
+            tau = self.tau.dist.transforms[0]._inverse(tau)
+        W = tau.view(-1, 1, 1) * self.scale @ states['U']
+        return self.activation(self.stacked_mm(Z, W))
+
+    def prior_log_prob_stacked(self, states):
+        return self.U.dist.log_prob(states['U']).flatten(1).sum(1) + \
+               self.tau.dist.log_prob(states['tau']).sum(-1)
@@ -0,0 +1,123 @@
+import math
+import numpy as np
+import pandas as pd
+import seaborn as sns
+import matplotlib.pyplot as plt
+import torch
+import torch.nn as nn
+import torch.distributions as td
+
+from Pytorch.Layer.GAM_banded import GAM_banded
+from Pytorch.Util.Util_Distribution import LogTransform
+from Pytorch.Util.Util_bspline import get_design_stacked
+
+
+class GAM_additive(GAM_banded):
+    def __init__(self, no_terms=2, xgrid=(0, 10, 0.5), order=1, no_basis=20,
+                 activation=nn.Identity(), bijected=True):
+        """
+        Additive model of no_terms smooth effects f(Z) = sum_j Z_j gamma_j, each
+        with its own banded RandomWalk Prior (see GAM_banded) and smoothness
+        variance tau_j. The coefficients are stacked into a single
+        W of shape (no_basis, no_terms) (the columns are the terms' gammas),
+        such that the forward pass is a single batched product and the prior
+        is one vectorized log density over all terms; i.e. the precision
+        of vec(W) is block diagonal.
+
+        The design is expected as the stacked designs Z of shape
+        (n, no_terms, no_basis) (see Util_bspline.get_design_stacked).
+
+        :param no_terms: number of smooth terms
+        for the remaining params see GAM
+        """
+        self.no_terms = no_terms
+        GAM_banded.__init__(self, xgrid, order, no_basis, no_terms, activation, bijected)
+
+    def define_model(self):
+        # setting up the banded penalty shared by all terms
+        self.define_proper_cov()
+
+        self.tau = nn.Parameter(torch.Tensor(self.no_terms))
+        self.tau.dist = td.Gamma(torch.ones(self.no_terms) * 2., torch.ones(self.no_terms) * 2.)
+        self.W = nn.Parameter(torch.Tensor(self.no_in, self.no_terms))
+
+        if self.bijected:
+            self.tau.dist = td.TransformedDistribution(self.tau.dist, LogTransform())
+        self.dist_parents = {'tau_bij': ('tau',)} if self.bijected else {}
+
+        self.tau.data = self.tau.dist.sample()
+        self.update_distributions()
+
+    def W_dist(self):
+        """all terms' random walk priors given the current tau (batch_shape no_terms).
+        Notice, that it is required for sampling W only."""
+        tau = self.tau_bij if self.bijected else self.tau
+        return td.MultivariateNormal(torch.zeros(self.no_terms, self.no_basis),
+                                     scale_tril=tau.detach().view(-1, 1, 1) * self.cov_chol)
+
+    def forward(self, Z):
+        """:param Z: Tensor of shape (n, no_terms, no_basis): stacked designs"""
+        return self.activation(torch.einsum('njk,kj->n', Z, self.W).view(Z.shape[0], 1))
+
+    def forward_stacked(self, Z, states):
+        return self.activation(torch.einsum('njb,kbj->kn', Z, states['W']).unsqueeze(-1))
+
+    def prior_log_prob(self):
+        """
+        returns: log_probability sum of all terms' gammas & taus; the random walk
+        priors of all terms are evaluated at once (see GAM.prior_log_prob)
+        """
+        tau = self.tau_bij if self.bijected else self.tau
+        const = - 0.5 * self.no_basis * math.log(2 * math.pi) + 0.5 * self.penK_logdet \
+                - self.no_basis * torch.log(tau)
+        kernel = - 0.5 * tau ** -2 * self.penalty(self.W)
+
+        return (const + kernel).sum().view(1) + self.tau.dist.log_prob(self.tau).sum()
+
+    def design(self, X):
+        """stacked designs of X (n, no_terms) on the fitted basis (see GAM.basis)"""
+        if self.basis is not None:
+            Z = np.stack([self.basis.transform(X[:, j].numpy()) for j in range(self.no_terms)], axis=1)
+        else:
+            Z = get_design_stacked(X.numpy(), degree=2, no_basis=self.no_basis)
+        return torch.tensor(Z, dtype=torch.float32)
+
+    @torch.no_grad()
+    def predict_terms(self, Z, chain=None):
+        """
+        :param Z: stacked designs (see design)
+        :param chain: list of state_dicts
+        :return: list of pd.DataFrames (one per term) of the terms' effects
+        Z_j gamma_j of the true, init, current & chain's states
+        """
+        states = {'current': self.W, 'true': self.true_model['W']}
+        if hasattr(self, 'init_model'):
+            states['init'] = self.init_model['W']
+        if chain is not None:
+            states.update({str(i): W for i, W in enumerate(self.stack_states(chain)['W'])})
+
+        return [pd.DataFrame({name: (Z[:, j] @ W[:, j]).numpy() for name, W in states.items()})
+                for j in range(self.no_terms)]
+
+    def plot(self, X, y, chain=None, path=None, title='', **kwargs):
+        """
+        one panel per smooth term: the term's effect Z_j gamma_j over X[:, j]
+        for the true, init, current & chain's states. As y is the sum of all
+        terms, it is not shown.
+        """
+        dfs = self.predict_terms(self.design(X), chain)
+
+        fig, axes = plt.subplots(nrows=1, ncols=self.no_terms, figsize=(5 * self.no_terms, 4), squeeze=False)
+        fig.suptitle('{}'.format(title))
+        for j, (ax, df) in enumerate(zip(axes[0], dfs)):
+            df['X'] = X[:, j].numpy()
+            df = df.melt('X', value_name='y').rename(columns={'variable': 'functions'})
+            sns.lineplot(x='X', y='y', hue='functions', alpha=0.5, data=df[df['functions'] != 'current'], ax=ax)
+            sns.lineplot(x='X', y='y', color='red', alpha=0.5, data=df[df['functions'] == 'current'], ax=ax,
+                         label='current')
+            ax.set_title('term {}'.format(j))
+
+        if path is None:
+            plt.show()
+        else:
+            fig.savefig('{}.pdf'.format(path), bbox_inches='tight')
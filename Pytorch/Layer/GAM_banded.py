@@ -0,0 +1,48 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+from Pytorch.Layer.GAM import GAM
+from Pytorch.Util.Util_bspline import diff_mat1D, banded_eigh, diff_coef
+
+
+class GAM_banded(GAM):
+    def __init__(self, xgrid=(0, 10, 0.5), order=1, no_basis=20, no_out=1,
+                 activation=nn.Identity(), bijected=True):
+        """
+        RandomWalk Prior Model on Gamma (W) vector in precision form. Instead of
+        a dense covariance, the penalty K = D^T D is kept as the banded difference
+        operator D of order 'order', such that W^T K W = ||D W||² is a sum over
+        order + 1 shifted copies of W, i.e. O(no_basis) per log_prob call.
+        K's nullspace is made proper (as in GAM) by the fraction of the smallest
+        non-zero eigenvalue; the log determinant of the proper penalty is cached
+        at construction.
+        For params see GAM.
+        """
+        GAM.__init__(self, xgrid, order, no_basis, no_out, activation, bijected)
+
+    def define_proper_cov(self):
+        # replace the nullspace's eigenvalues by fraction*(smallest non-zero eigenval)
+        # to ensure a propper distribution (see Marra Wood or Wood JAGS)
+        fraction = 1e-1
+
+        # banded difference operator: (D W)_i = sum_j (-1)^(order - j) binom(order, j) W_(i + j)
+        self.diff_coef = torch.tensor(diff_coef(self.order), dtype=torch.float32)
+
+        # eigenvalues are required once only: K's nullspace (polynomials of
+        # degree < order) has dimension order
+        K = diff_mat1D(self.no_basis, self.order, sparse=True)[1]
+        val, vec = banded_eigh(K, self.order)
+        val[:self.order] = val[self.order] * fraction
+        self.null_val = float(val[0])
+        self.null_vec = torch.tensor(vec[:, :self.order], dtype=torch.float32)
+
+        self.penK_logdet = torch.tensor(np.sum(np.log(val)), dtype=torch.float32)
+        self.cov_chol = torch.tensor(np.linalg.cholesky((vec / val) @ vec.T), dtype=torch.float32)
+
+    def penalty(self, W):
+        """quadratic form W^T penK W = ||D W||² + null_val * ||V_0^T W||² (columnwise)
+        with V_0 the (orthonormal) nullspace of K"""
+        m = self.no_basis - self.order
+        DW = sum(c * W.narrow(-2, j, m) for j, c in enumerate(self.diff_coef))
+        return (DW ** 2).sum(-2) + self.null_val * ((self.null_vec.t() @ W) ** 2).sum(-2)
@@ -1,14 +1,19 @@
 import torch
 import torch.nn as nn
 import torch.distributions as td
+from copy import deepcopy
 
 from Pytorch.Layer.Hidden import Hidden
 from Pytorch.Layer.Group_lasso import Group_lasso
 from Pytorch.Util.Util_Distribution import LogTransform
+from Pytorch.Util.Util_Prior import group_horseshoe_log_prob, group_horseshoe_grad, log_bijected, \
+    halfcauchy_log_prob, normal_log_prob, normal_log_prob_log_scale, group_horseshoe_nc_log_prob, \
+    group_horseshoe_nc_grad
 
 
 class Group_HorseShoe(Group_lasso):
     prior_log_prob = Group_lasso.prior_log_prob
+    conditionals = ('tau',)  # no lamb in the horseshoe
 
     def __init__(self, no_in, no_out, bias=True, activation=nn.ReLU(), bijected=True, seperated=True):
         """
@@ -28,6 +33,7 @@ class Group_HorseShoe(Group_lasso):
         self.dist['tau'] = td.HalfCauchy(torch.tensor([1.]))
         if self.bijected:
             self.dist['tau'] = td.TransformedDistribution(self.dist['tau'], LogTransform())
+        self.dist_parents = {'W_shrinked': ('tau',)}  # tau's prior no longer depends on lamb
 
         self.reset_parameters(seperated=seperated)
 
@@ -39,9 +45,118 @@ class Group_HorseShoe(Group_lasso):
         else:
             self.dist['W_shrinked'].scale = self.tau ** 2
 
+    def functional_prior_log_prob(self):
+        return group_horseshoe_log_prob(self.W, self.W_shrinked, self.tau, self.bijected)
+
+    def conditional_log_prob(self, name, value):
+        if name != 'tau':
+            raise ValueError('{} has no full conditional'.format(name))
+        if self.bijected:
+            log_prob = log_bijected(halfcauchy_log_prob, value) + \
+                       normal_log_prob_log_scale(self.W_shrinked, value).sum()
+        else:
+            log_prob = halfcauchy_log_prob(value) + normal_log_prob(self.W_shrinked, scale=value ** 2).sum()
+        return log_prob.view_as(value)
+
+    def prior_grad(self):
+        gW, g_shrinked, g_tau = group_horseshoe_grad(self.W, self.W_shrinked, self.tau, self.bijected)
+        return {'W': gW, 'W_shrinked': g_shrinked, 'tau': g_tau}
+
+    def prior_log_prob_stacked(self, states):
+        return group_horseshoe_log_prob(states['W'], states['W_shrinked'], states['tau'].view(-1, 1, 1),
+                                        self.bijected, chains=True)
+
+    def shrinked_scale(self, tau):
+        return tau.exp() if self.bijected else tau ** 2
+
+
+
+class Group_HorseShoe_NC(Group_HorseShoe):
+    # tau's full conditional involves the likelihood: W_shrinked depends on it
+    conditionals = ()
+
+    def __init__(self, no_in, no_out, bias=True, activation=nn.ReLU(), bijected=True, seperated=True):
+        """
+        Non-centered parametrization of Group_HorseShoe: the sampled weights
+        W_raw ~ N(0, 1) are a priori independent of tau and
+        W_shrinked = scale(tau) * W_raw (see shrinked_scale) is derived in forward.
+        This removes the funnel of W_shrinked and its scale tau, which otherwise
+        forces small step sizes. The posterior is the same as Group_HorseShoe's.
+        for params see Group_HorseShoe
+        """
+        Group_HorseShoe.__init__(self, no_in, no_out, bias, activation, bijected, seperated)
+
+    def define_model(self):
+        self.m = self.no_out
+
+        self.tau = nn.Parameter(torch.tensor(1.))
+        self.dist['tau'] = td.HalfCauchy(torch.tensor([1.]))
+        if self.bijected:
+            self.dist['tau'] = td.TransformedDistribution(self.dist['tau'], LogTransform())
+
+        self.W_raw = nn.Parameter(torch.Tensor(1, self.no_out))
+        self.W = nn.Parameter(torch.Tensor(self.no_in - 1, self.no_out))
+        self.dist['W_raw'] = td.Normal(torch.zeros(self.no_out), 1.)
+        self.dist['W'] = td.Normal(torch.zeros((self.no_in - 1) * self.no_out), torch.tensor([1.]))
+
+        # W_shrinked's (implied) distribution, of which alpha relies on the scale
+        self.dist['W_shrinked'] = td.Normal(torch.zeros(self.no_out), 1.)
+        self.dist_parents = {'W_shrinked': ('tau',)}
+
+        if self.has_bias:
+            self.b = nn.Parameter(torch.Tensor(self.no_out))
+            self.dist['b'] = td.Normal(torch.zeros(self.no_out), 1.)
+
+    @property
+    def W_shrinked(self):
+        return self.shrinked_scale(self.tau) * self.W_raw
+
+    def reset_parameters(self, seperated=False):
+        if seperated:  # allows XOR Decision in data generating procecss
+            if self.bijected:
+                self.tau.data = self.dist['tau'].transforms[0](torch.tensor([0.001]))
+            else:
+                self.tau.data = torch.tensor([0.001])
+        else:
+            self.tau.data = self.dist['tau'].sample()
+        self.update_distributions()
+
+        self.W.data = self.dist['W'].sample().view(self.no_in - 1, self.no_out)
+        self.W_raw.data = self.dist['W_raw'].sample().view(1, self.no_out)
+        if self.has_bias:
+            self.b.data = self.dist['b'].sample()
+
+        self.init_model = deepcopy(self.state_dict())
+
+    def prior_log_prob(self):
+        return self.functional_prior_log_prob()
+
+    def functional_prior_log_prob(self):
+        return group_horseshoe_nc_log_prob(self.W, self.W_raw, self.tau, self.bijected)
+
+    def analytic_backward(self, cache, df, input_grad=True):
+        """Group_lasso.analytic_backward & the chain rule through W_shrinked"""
+        dX, grads = Group_lasso.analytic_backward(self, cache, df, input_grad)
+        g_shrinked = grads.pop('W_shrinked')
+        dscale = self.tau.exp() if self.bijected else 2 * self.tau
+        grads['W_raw'] = g_shrinked * self.shrinked_scale(self.tau)
+        grads['tau'] = ((g_shrinked * self.W_raw).sum() * dscale).sum_to_size(self.tau.shape)
+        return dX, grads
+
+    def prior_grad(self):
+        gW, g_raw, g_tau = group_horseshoe_nc_grad(self.W, self.W_raw, self.tau, self.bijected)
+        return {'W': gW, 'W_raw': g_raw, 'tau': g_tau}
+
+    def forward_stacked(self, X, states):
+        W_shrinked = self.shrinked_scale(states['tau'].view(-1, 1, 1)) * states['W_raw']
+        return Group_HorseShoe.forward_stacked(self, X, dict(states, W_shrinked=W_shrinked))
+
+    def prior_log_prob_stacked(self, states):
+        return group_horseshoe_nc_log_prob(states['W'], states['W_raw'], states['tau'].view(-1, 1, 1),
+                                           self.bijected, chains=True)
+
 
 if __name__ == '__main__':
-    from copy import deepcopy
 
     while True:
         no_in = 2
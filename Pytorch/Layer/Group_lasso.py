@@ -6,9 +6,19 @@ from copy import deepcopy
 
 from Pytorch.Layer.Hidden import Hidden
 from Pytorch.Util.Util_Distribution import LogTransform
+from Pytorch.Util.Util_Prior import group_lasso_log_prob, group_lasso_grad, log_bijected, \
+    gamma_log_prob, halfcauchy_log_prob, normal_log_prob, normal_log_prob_log_scale
 
 
 class Group_lasso(Hidden):
+    # evaluate the prior by its closed form tensor function rather than
+    # the (updated) distribution objects in self.dist
+    functional_prior = True
+
+    # hyperparameters with full conditionals (see conditional_log_prob), which
+    # Metropolis_within_Gibbs draws exactly. lamb (no nn.Parameter) thereby
+    # becomes learnable with its hyperprior self.dist['lamb']
+    conditionals = ('tau', 'lamb')
 
     def __init__(self, no_in, no_out, bias=True, activation=nn.ReLU(), bijected=True):
         """
@@ -44,6 +54,9 @@ class Group_lasso(Hidden):
             self.dist['lamb'] = td.TransformedDistribution(self.dist['lamb'], LogTransform())
             self.dist['tau'] = td.TransformedDistribution(self.dist['tau'], LogTransform())
 
+        # dependency DAG of the conditional distributions (see update_distributions)
+        self.dist_parents = {'tau': ('lamb',), 'W_shrinked': ('tau',)}
+
         # Group lasso structure of W
         self.W_shrinked = nn.Parameter(torch.Tensor(1, self.no_out))
         self.W = nn.Parameter(torch.Tensor(self.no_in - 1, self.no_out))
@@ -114,6 +127,8 @@ class Group_lasso(Hidden):
 
     def prior_log_prob(self):
         """evaluate each parameter in respective distrib."""
+        if self.functional_prior:
+            return self.functional_prior_log_prob()
 
         value = torch.tensor(0.)
         p_names = ['tau', 'W', 'W_shrinked']
@@ -122,6 +137,90 @@ class Group_lasso(Hidden):
 
         return value
 
+    def functional_prior_log_prob(self):
+        """closed form prior log density of (W, W_shrinked, tau, lamb), which
+        does not depend on the state of self.dist (i.e. on update_distributions)"""
+        return group_lasso_log_prob(self.W, self.W_shrinked, self.tau, self.lamb,
+                                    self.m, self.bijected)
+
+    def conditional_log_prob(self, name, value):
+        """
+        unnormalized full conditional log density of a hyperparameter
+        :param name: str. 'tau' | 'lamb'
+        :param value: Tensor. the hyperparameter's value (on the bijected
+        scale, if self.bijected)
+        :return: Tensor of value's shape
+        """
+        conc = (self.m + 1) / 2
+        if name == 'tau':
+            if self.bijected:
+                log_prob = log_bijected(gamma_log_prob, value, conc, torch.exp(2 * self.lamb) / 2) + \
+                           normal_log_prob_log_scale(self.W_shrinked, value).sum()
+            else:
+                log_prob = gamma_log_prob(value, conc, self.lamb ** 2 / 2) + \
+                           normal_log_prob(self.W_shrinked, scale=value).sum()
+
+        elif name == 'lamb':
+            if self.bijected:
+                log_prob = log_bijected(halfcauchy_log_prob, value) + \
+                           log_bijected(gamma_log_prob, self.tau, conc, torch.exp(2 * value) / 2).sum()
+            else:
+                log_prob = halfcauchy_log_prob(value) + gamma_log_prob(self.tau, conc, value ** 2 / 2).sum()
+
+        else:
+            raise ValueError('{} has no full conditional'.format(name))
+
+        return log_prob.view_as(value)
+
+    # ANALYTIC GRADIENTS: see Util_Model.log_prob_and_grad
+    @property
+    def analytic_layer(self):
+        return type(self.activation) in self.activation_grads and self.functional_prior and \
+               type(self).forward is Group_lasso.forward
+
+    def analytic_forward(self, X):
+        A = X[:, :1] @ self.W_shrinked + X[:, 1:] @ self.W
+        if self.has_bias:
+            A = A + self.b
+        f = self.activation(A)
+        return f, (X, A, f)
+
+    def analytic_backward(self, cache, df, input_grad=True):
+        X, A, f = cache
+        dA = self.activation_backward(A, f, df)
+        XdA = X.t() @ dA  # gradient of the joint W = [W_shrinked; W]
+        grads = {'W_shrinked': XdA[:1], 'W': XdA[1:]}
+        if self.has_bias:
+            grads['b'] = dA.sum(0)
+        if not input_grad:
+            return None, grads
+        return dA @ torch.cat([self.W_shrinked, self.W], dim=0).t(), grads
+
+    def prior_grad(self):
+        """gradients of functional_prior_log_prob (b has no prior)"""
+        gW, g_shrinked, g_tau = group_lasso_grad(self.W, self.W_shrinked, self.tau, self.lamb,
+                                                 self.m, self.bijected)
+        return {'W': gW, 'W_shrinked': g_shrinked, 'tau': g_tau}
+
+    # STACKED (MULTI CHAIN) EXECUTION: see Hidden.forward_stacked
+    def forward_stacked(self, X, states):
+        XW = self.stacked_mm(X[..., :1], states['W_shrinked']) + \
+             self.stacked_mm(X[..., 1:], states['W'], states.get('b'))
+        return self.activation(XW)
+
+    def prior_log_prob_stacked(self, states):
+        return group_lasso_log_prob(states['W'], states['W_shrinked'], states['tau'].view(-1, 1, 1),
+                                    self.lamb, self.m, self.bijected, chains=True)
+
+    def shrinked_scale(self, tau):
+        """W_shrinked's scale given tau (see update_distributions)"""
+        return tau.exp() if self.bijected else tau
+
+    def alpha_stacked(self, states):
+        """alpha of K stacked states: Tensor of shape (K, 1, 1), which unlike
+        alpha does not rely on the state of self.dist['W_shrinked']"""
+        return 1 - self.dist['alpha'].cdf(self.shrinked_scale(states['tau'].view(-1, 1, 1)))
+
     @property
     def alpha(self):
         """attribute in interval [0,1], which decides upon the degree of how much
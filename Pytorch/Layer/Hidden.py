@@ -1,9 +1,12 @@
+import math
 import torch
 import torch.nn as nn
 import torch.distributions as td
 
 from copy import deepcopy
 from Pytorch.Util.Util_Model import Util_Model
+from Pytorch.Util.Util_Prior import FusedPrior, static_grad, flat_log_prob
+from Pytorch.Util.Util_Sparse import is_sparse
 
 
 class Hidden(nn.Module, Util_Model):
@@ -37,7 +40,11 @@ class Hidden(nn.Module, Util_Model):
         self.reset_parameters()
         self.true_model = None
 
+        # sufficient statistics of the full batch (see sufficient_statistics)
+        self.suff_stat = None
+
     def define_model(self):
+        self.dist_parents = {}  # no hierarchical distributions (see Util_Model.refresh_distributions)
         self.tau_w = torch.tensor([1.])
 
         # self.tau_w = nn.Parameter(torch.tensor([1.]))
@@ -66,7 +73,11 @@ class Hidden(nn.Module, Util_Model):
     # (2) DEFINE THESE FUNCTIONS IN REFERENCE TO SURROGATE PARAM: --------------
     # & inherit for layers
     def forward(self, X):
-        XW = X @ self.W
+        if is_sparse(X):
+            # e.g. sparse bspline design: cost scales with the non-zero elements
+            XW = torch.sparse.mm(X, self.W)
+        else:
+            XW = X @ self.W
         if self.has_bias:
             XW += self.b
         return self.activation(XW)
@@ -75,9 +86,192 @@ class Hidden(nn.Module, Util_Model):
         """evaluate each parameter in respective distrib."""
         value = torch.tensor(0.)
         for p in self.parameters():
-            value += p.distrib.log_prob(p).sum()
+            if type(p.distrib) in FusedPrior.flat:
+                value += flat_log_prob(p.distrib, p)
+            else:
+                value += p.distrib.log_prob(p).sum()
         return value
 
+    # SUFFICIENT STATISTICS of LINEAR GAUSSIAN MODELS
+    @property
+    def linear_gaussian(self):
+        """whether the model is linear in its parameters with Util_Model's
+        y ~ N(XW + b, 1) likelihood (e.g. Hidden(..., activation=nn.Identity()), GAM)"""
+        return type(self).forward is Hidden.forward and isinstance(self.activation, nn.Identity) \
+               and type(self).likelihood is Util_Model.likelihood
+
+    @torch.no_grad()
+    def sufficient_statistics(self, X, y):
+        """
+        precompute X^T X, X^T y, y^T y and n of the full batch once, such that
+        the Gaussian log likelihood (& its gradient) of any subsequent log_prob
+        call on this data costs O(p²) rather than a forward pass of X.
+        The statistics are used (see uses_suff_stat) only, if log_prob is called
+        with these very tensors X, y, as long as they are not modified in place;
+        i.e. full batch trainloaders must yield them as is (see Util_Data.FullBatch).
+
+        :param X: Tensor (dense or sparse) of shape (n, no_in)
+        :param y: Tensor of shape (n, no_out)
+        """
+        if not self.linear_gaussian:
+            raise ValueError('sufficient statistics require a linear gaussian model')
+        data = {'X': X, 'y': y, 'versions': (X._version, y._version)}
+
+        if is_sparse(X):
+            X = X.to_dense()
+        if self.has_bias:
+            X = torch.cat([X, torch.ones(X.shape[0], 1)], dim=1)
+        # double precision: y^T y & W^T X^T X W nearly cancel for large n
+        X, y = X.double(), y.view(X.shape[0], -1).double()
+
+        self.suff_stat = {'XtX': X.t() @ X, 'Xty': X.t() @ y, 'yty': (y ** 2).sum(),
+                          'n': X.shape[0], **data}
+
+    def uses_suff_stat(self, X, y):
+        """whether X, y are the (unmodified) tensors of sufficient_statistics"""
+        s = self.suff_stat
+        return s is not None and X is s['X'] and y is s['y'] and \
+               (X._version, y._version) == s['versions']
+
+    def suff_log_likelihood(self):
+        """Gaussian log likelihood based on the sufficient statistics:
+        -0.5 * (y^T y - 2 W^T X^T y + W^T X^T X W) - n / 2 log(2 pi) (per output)"""
+        s = self.suff_stat
+        W = torch.cat([self.W, self.b.view(1, -1)], dim=0) if self.has_bias else self.W
+        W = W.double()
+        quad = s['yty'] - 2 * (W * s['Xty']).sum() + (W * (s['XtX'] @ W)).sum()
+        return (- 0.5 * quad - 0.5 * s['n'] * W.shape[1] * math.log(2 * math.pi)).float()
+
+    def my_log_prob(self, X, y):
+        if self.uses_suff_stat(X, y):
+            return self.prior_log_prob() + self.suff_log_likelihood()
+        return Util_Model.my_log_prob(self, X, y)
+
+    def compile_log_prob(self, X, y):
+        # the trace must not bake in the (data dependent) sufficient statistics' branch
+        suff_stat, self.suff_stat = self.suff_stat, None
+        try:
+            return Util_Model.compile_log_prob(self, X, y)
+        finally:
+            self.suff_stat = suff_stat
+
+    def chunked(self, X, y):
+        # the sufficient statistics' likelihood is independent of n
+        return not self.uses_suff_stat(X, y) and Util_Model.chunked(self, X, y)
+
+    # ANALYTIC GRADIENTS: see Util_Model.log_prob_and_grad
+    # derivatives of the supported activations given their input A & output f
+    activation_grads = {
+        nn.Identity: None,
+        nn.ReLU: lambda A, f: f.sign(),  # f = relu(A) >= 0: 1 where A > 0 else 0
+        nn.Sigmoid: lambda A, f: f * (1 - f),
+        nn.Tanh: lambda A, f: 1 - f ** 2}
+
+    @property
+    def analytic_layer(self):
+        """whether forward & prior_log_prob of this layer have gradient kernels"""
+        return type(self.activation) in self.activation_grads and \
+               type(self).forward is Hidden.forward and \
+               type(self).prior_log_prob is Hidden.prior_log_prob and \
+               all(type(p.distrib) in FusedPrior.families for p in self.parameters(recurse=False))
+
+    @property
+    def analytic_grad(self):
+        return self.use_analytic_grad and self.analytic_layer and \
+               type(self).likelihood is Util_Model.likelihood and \
+               type(self).my_log_prob is Hidden.my_log_prob
+
+    def analytic_forward(self, X):
+        """:returns forward(X) & the cache of analytic_backward"""
+        if is_sparse(X):
+            A = torch.sparse.mm(X, self.W)
+        else:
+            A = X @ self.W
+        if self.has_bias:
+            A = A + self.b
+        f = self.activation(A)
+        return f, (X, A, f)
+
+    def activation_backward(self, A, f, df):
+        """gradient wrt. the activation's input A given df wrt. its output f"""
+        act_grad = self.activation_grads[type(self.activation)]
+        return df if act_grad is None else df * act_grad(A, f)
+
+    def analytic_backward(self, cache, df, input_grad=True):
+        """
+        :param cache: analytic_forward's cache
+        :param df: gradient of log_prob wrt. the layer's output
+        :param input_grad: bool. whether to compute the gradient wrt. the layer's input
+        :return: tuple: the input's gradient (or None), dict of the parameters' gradients
+        """
+        X, A, f = cache
+        dA = self.activation_backward(A, f, df)
+        grads = {'W': torch.sparse.mm(X.t(), dA) if is_sparse(X) else X.t() @ dA}
+        if self.has_bias:
+            grads['b'] = dA.sum(0)
+        return (dA @ self.W.t() if input_grad else None), grads
+
+    def prior_grad(self):
+        """:returns dict of prior_log_prob's gradients wrt. the parameters;
+        flat priors (zero gradient) are omitted"""
+        return {name: static_grad(p.distrib, p) for name, p in self.named_parameters()
+                if type(p.distrib) not in FusedPrior.flat}
+
+    def log_prob_and_grad(self, X, y):
+        if not self.uses_suff_stat(X, y):
+            return Util_Model.log_prob_and_grad(self, X, y)
+
+        # gradient of the likelihood's quadratic form: X^T y - X^T X W
+        with torch.no_grad():
+            s = self.suff_stat
+            W = torch.cat([self.W, self.b.view(1, -1)], dim=0) if self.has_bias else self.W
+            dW = (s['Xty'] - s['XtX'] @ W.double()).float()
+
+            grads = self.prior_grad()
+            grads['W'] = grads.get('W', 0.) + dW[:self.no_in]
+            if self.has_bias:
+                grads['b'] = grads.get('b', 0.) + dW[-1]
+            value = self.prior_log_prob() + self.suff_log_likelihood()
+
+        return value, [grads[name] for name, _ in self.named_parameters()]
+
+    # STACKED (MULTI CHAIN) EXECUTION: see Util_Model.stack_states
+    @staticmethod
+    def stacked_mm(X, W, b=None):
+        """
+        :param X: Tensor of shape (n, no_in) (dense or sparse) or (K, n, no_in)
+        :param W: stacked weights of shape (K, no_in, no_out)
+        :param b: None or stacked bias of shape (K, no_out), which is fused
+        into the batched product
+        :return: Tensor of shape (K, n, no_out)
+        """
+        K, no_in, no_out = W.shape
+        if is_sparse(X):
+            # single sparse product with all chains' weights side by side
+            XW = torch.sparse.mm(X, W.permute(1, 0, 2).reshape(no_in, K * no_out))
+            XW = XW.view(-1, K, no_out).transpose(0, 1)
+            return XW if b is None else XW + b.unsqueeze(1)
+
+        if X.dim() == 2:
+            X = X.expand(K, *X.shape)  # no copy
+        if b is None:
+            return torch.bmm(X, W)
+        return torch.baddbmm(b.unsqueeze(1), X, W)
+
+    def forward_stacked(self, X, states):
+        """
+        forward pass of K states at once
+        :param X: Tensor of shape (n, no_in) or (K, n, no_in)
+        :param states: dict of the layer's stacked parameters (see Util_Model.stack_states)
+        :return: Tensor of shape (K, n, no_out)
+        """
+        return self.activation(self.stacked_mm(X, states['W'], states.get('b')))
+
+    def prior_log_prob_stacked(self, states):
+        """:return: prior_log_prob of K stacked states: Tensor of shape (K, )"""
+        return sum(p.distrib.log_prob(states[name]).flatten(1).sum(1)
+                   for name, p in self.named_parameters())
+
 
 class Hidden_flat(Hidden):
     def define_model(self):
@@ -85,6 +279,7 @@ class Hidden_flat(Hidden):
         formulate the model with truncated flat priors
         :return:
         """
+        self.dist_parents = {}
         self.W = nn.Parameter(torch.Tensor(self.no_in, self.no_out))
         self.W.distrib = td.Uniform(torch.ones(self.no_in, self.no_out) * -100.,
                                     torch.ones(self.no_in, self.no_out) * 100)
@@ -5,12 +5,18 @@ import torch.distributions as td
 from Pytorch.Layer.Hidden import Hidden
 from Pytorch.Layer.Group_lasso import Group_lasso
 from Pytorch.Util.Util_Distribution import LogTransform
+from Pytorch.Util.Util_Prior import hierarchical_group_horseshoe_log_prob, \
+    hierarchical_group_horseshoe_nc_log_prob
 from copy import deepcopy
 
 
 class Hierarchical_Group_HorseShoe(Hidden, ):
     prior_log_prob = Group_lasso.prior_log_prob
 
+    # evaluate the prior by its closed form tensor function rather than
+    # the (updated) distribution objects p.dist
+    functional_prior = True
+
     def __init__(self, no_in, no_out, bias=True, activation=nn.ReLU(), bijected=True, seperated=True):
         """
         Group Lasso Layer, which is essentially a Hidden Layer, but with a different
@@ -40,6 +46,9 @@ class Hierarchical_Group_HorseShoe(Hidden, ):
             self.lamb.dist = td.TransformedDistribution(self.lamb.dist, LogTransform())
             self.tau.dist = td.TransformedDistribution(self.tau.dist, LogTransform())
 
+        # dependency DAG of the conditional distributions (see update_distributions)
+        self.dist_parents = {'W_shrinked': ('tau', 'lamb')}
+
         # Group lasso structure of W
         self.W_shrinked = nn.Parameter(torch.Tensor(self.no_in, self.no_out))
         self.W_shrinked.dist = td.Normal(torch.zeros(self.no_out, self.no_in), self.tau ** 2 * self.lamb)
@@ -82,6 +91,8 @@ class Hierarchical_Group_HorseShoe(Hidden, ):
         self.init_model = deepcopy(self.state_dict())
 
     def prior_log_prob(self):
+        if self.functional_prior:
+            return self.functional_prior_log_prob()
 
         value = torch.tensor(0.)
         for name, p in self.named_parameters():
@@ -94,6 +105,84 @@ class Hierarchical_Group_HorseShoe(Hidden, ):
 
         return value
 
+    def functional_prior_log_prob(self):
+        """closed form prior log density of (W_shrinked, b, tau, lamb), which
+        does not depend on the state of p.dist (i.e. on update_distributions)"""
+        return hierarchical_group_horseshoe_log_prob(
+            self.W_shrinked, self.b if self.has_bias else None,
+            self.tau, self.lamb, self.bijected)
+
+    # STACKED (MULTI CHAIN) EXECUTION: see Hidden.forward_stacked
+    def forward_stacked(self, X, states):
+        return self.activation(self.stacked_mm(X, states['W_shrinked'], states.get('b')))
+
+    def prior_log_prob_stacked(self, states):
+        K = states['tau'].shape[0]
+        return hierarchical_group_horseshoe_log_prob(
+            states['W_shrinked'], states.get('b'), states['tau'].view(K, 1, -1),
+            states['lamb'].view(K, 1, 1), self.bijected, chains=True)
+
+
+
+class Hierarchical_Group_HorseShoe_NC(Hierarchical_Group_HorseShoe):
+    def __init__(self, no_in, no_out, bias=True, activation=nn.ReLU(), bijected=True, seperated=True):
+        """
+        Non-centered parametrization of Hierarchical_Group_HorseShoe: the sampled
+        weights W_raw ~ N(0, 1) are a priori independent of (tau, lamb) and
+        W_shrinked[j] = tau_j² lamb W_raw[j] is derived in forward, which removes
+        the funnel of W_shrinked and its scales. The posterior is unchanged.
+        for params see Hierarchical_Group_HorseShoe
+        """
+        Hierarchical_Group_HorseShoe.__init__(self, no_in, no_out, bias, activation, bijected, seperated)
+
+    def define_model(self):
+        self.lamb = nn.Parameter(torch.tensor([0.9]))
+        self.lamb.dist = td.HalfCauchy(scale=torch.tensor([1.]))
+
+        self.tau = nn.Parameter(torch.ones(self.no_in))
+        self.tau.dist = td.HalfCauchy(torch.ones(self.no_in))
+
+        if self.bijected:
+            self.lamb.dist = td.TransformedDistribution(self.lamb.dist, LogTransform())
+            self.tau.dist = td.TransformedDistribution(self.tau.dist, LogTransform())
+
+        self.W_raw = nn.Parameter(torch.Tensor(self.no_in, self.no_out))
+        self.W_raw.dist = td.Normal(torch.zeros(self.no_in, self.no_out), 1.)
+        self.dist_parents = {}  # W_raw's prior is independent of (tau, lamb)
+
+        if self.has_bias:
+            self.b = nn.Parameter(torch.Tensor(self.no_out))
+            self.b.dist = td.Normal(torch.zeros(self.no_out), 1.)
+
+    def shrinked_scale(self, tau, lamb):
+        """W_shrinked's scale tau² lamb (see update_distributions of the centered layer)"""
+        return torch.exp(2 * tau + lamb) if self.bijected else tau ** 2 * lamb
+
+    @property
+    def W_shrinked(self):
+        return self.shrinked_scale(self.tau, self.lamb).view(-1, 1) * self.W_raw
+
+    def update_distributions(self):
+        # no hierarchical distributions: W_raw's prior does not depend on (tau, lamb)
+        return None
+
+    def functional_prior_log_prob(self):
+        return hierarchical_group_horseshoe_nc_log_prob(
+            self.W_raw, self.b if self.has_bias else None,
+            self.tau, self.lamb, self.bijected)
+
+    def forward_stacked(self, X, states):
+        K = states['tau'].shape[0]
+        W_shrinked = self.shrinked_scale(states['tau'].view(K, -1, 1), states['lamb'].view(K, 1, 1)) * \
+                     states['W_raw']
+        return self.activation(self.stacked_mm(X, W_shrinked, states.get('b')))
+
+    def prior_log_prob_stacked(self, states):
+        K = states['tau'].shape[0]
+        return hierarchical_group_horseshoe_nc_log_prob(
+            states['W_raw'], states.get('b'), states['tau'], states['lamb'].view(K, 1),
+            self.bijected, chains=True)
+
 
 if __name__ == '__main__':
 
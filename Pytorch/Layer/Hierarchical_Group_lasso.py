@@ -6,9 +6,17 @@ from copy import deepcopy
 
 from Pytorch.Layer.Hidden import Hidden
 from Pytorch.Util.Util_Distribution import LogTransform
+from Pytorch.Util.Util_Prior import hierarchical_group_lasso_log_prob, log_bijected, \
+    gamma_log_prob, halfcauchy_log_prob, normal_log_prob, normal_log_prob_log_scale
 
 
 class Hierarchical_Group_lasso(Hidden):
+    # evaluate the prior by its closed form tensor function rather than
+    # the (updated) distribution objects p.dist
+    functional_prior = True
+
+    # hyperparameters with full conditionals (see Group_lasso.conditionals)
+    conditionals = ('tau', 'lamb')
 
     def __init__(self, no_in, no_out, bias=True, activation=nn.ReLU(), bijected=True):
         """
@@ -40,6 +48,9 @@ class Hierarchical_Group_lasso(Hidden):
             self.lamb.dist = td.TransformedDistribution(self.lamb.dist, LogTransform())
             self.tau.dist = td.TransformedDistribution(self.tau.dist, LogTransform())
 
+        # dependency DAG of the conditional distributions (see update_distributions)
+        self.dist_parents = {'tau': ('lamb',), 'W_shrinked': ('tau',)}
+
         # Group lasso structure of W
         self.W_shrinked = nn.Parameter(torch.Tensor(self.no_in, self.no_out))
         self.W_shrinked.dist = td.Normal(torch.zeros(self.no_out, self.no_in), self.tau ** 2)
@@ -88,6 +99,9 @@ class Hierarchical_Group_lasso(Hidden):
             self.update_distributions()
 
     def prior_log_prob(self):
+        if self.functional_prior:
+            return self.functional_prior_log_prob()
+
         value = torch.tensor(0.)
         for name, p in self.named_parameters():
             if name.endswith('W_shrinked'):
@@ -98,6 +112,46 @@ class Hierarchical_Group_lasso(Hidden):
 
         return value
 
+    def functional_prior_log_prob(self):
+        """closed form prior log density of (W_shrinked, b, tau, lamb), which
+        does not depend on the state of p.dist (i.e. on update_distributions)"""
+        return hierarchical_group_lasso_log_prob(
+            self.W_shrinked, self.b if self.has_bias else None,
+            self.tau, self.lamb, self.m, self.bijected)
+
+    def conditional_log_prob(self, name, value):
+        """
+        unnormalized full conditional log density of a hyperparameter
+        :param name: str. 'tau' | 'lamb'
+        :param value: Tensor. the hyperparameter's value (on the bijected
+        scale, if self.bijected)
+        :return: Tensor of value's shape; the tau_j are conditionally independent
+        """
+        conc = (self.m + 1) / 2
+        if name == 'tau':
+            if self.bijected:
+                return log_bijected(gamma_log_prob, value, conc, torch.exp(2 * self.lamb) / 2) + \
+                       normal_log_prob_log_scale(self.W_shrinked.t(), value).sum(0, keepdim=True)
+            return gamma_log_prob(value, conc, self.lamb ** 2 / 2) + \
+                   normal_log_prob(self.W_shrinked.t(), scale=value).sum(0, keepdim=True)
+
+        elif name == 'lamb':
+            if self.bijected:
+                return log_bijected(halfcauchy_log_prob, value) + \
+                       log_bijected(gamma_log_prob, self.tau, conc, torch.exp(2 * value) / 2).sum()
+            return halfcauchy_log_prob(value) + gamma_log_prob(self.tau, conc, value ** 2 / 2).sum()
+
+        raise ValueError('{} has no full conditional'.format(name))
+
+    # STACKED (MULTI CHAIN) EXECUTION: see Hidden.forward_stacked
+    def forward_stacked(self, X, states):
+        return self.activation(self.stacked_mm(X, states['W_shrinked'], states.get('b')))
+
+    def prior_log_prob_stacked(self, states):
+        return hierarchical_group_lasso_log_prob(
+            states['W_shrinked'], states.get('b'), states['tau'],
+            states['lamb'].view(-1, 1, 1), self.m, self.bijected, chains=True)
+
     # @property
     # def alpha(self):
     #     """attribute in interval [0,1], which decides upon the degree of how much
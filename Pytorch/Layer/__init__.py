@@ -1,4 +1,8 @@
 from Pytorch.Layer.Hidden import Hidden, Hidden_flat
 from Pytorch.Layer.Group_lasso import Group_lasso
-from Pytorch.Layer.Group_HorseShoe import Group_HorseShoe
+from Pytorch.Layer.Group_HorseShoe import Group_HorseShoe, Group_HorseShoe_NC
 from Pytorch.Layer.GAM import GAM
+from Pytorch.Layer.GAM_banded import GAM_banded
+from Pytorch.Layer.GAM2D import GAM2D
+from Pytorch.Layer.GAM_additive import GAM_additive
+from Pytorch.Layer.GAM_Demmler import GAM_Demmler
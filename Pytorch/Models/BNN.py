@@ -5,6 +5,7 @@ import inspect
 
 from Pytorch.Layer.Hidden import Hidden, Hidden_flat
 from Pytorch.Util.Util_Model import Util_Model
+from Pytorch.Util.Util_Prior import FusedPrior
 
 from copy import deepcopy
 
@@ -31,6 +32,7 @@ class BNN(nn.Module, Util_Model):
         self.final_activation = final_activation
 
         self.define_model()
+        self.compile_prior()
         self.reset_parameters()
 
         self.true_model = None
@@ -69,9 +71,20 @@ class BNN(nn.Module, Util_Model):
 
         self.init_model = deepcopy(self.state_dict())
 
+    def compile_prior(self):
+        """fuse the static priors of all layers, which use the generic
+        Hidden.prior_log_prob, into a single FusedPrior. Layers with
+        hierarchical priors (e.g. shrinkage layers) remain evaluated by their
+        own prior_log_prob. Call it again, whenever a layer's distrib is replaced."""
+        fused = [type(h).prior_log_prob is Hidden.prior_log_prob for h in self.layers]
+        self.fused_prior = FusedPrior(p for h, f in zip(self.layers, fused) if f
+                                      for p in h.parameters())
+        self.unfused_layers = [h for h, f in zip(self.layers, fused) if not f]
+
     def prior_log_prob(self):
         """surrogate for the hidden layers' prior log prob"""
-        p_log_prob = sum([h.prior_log_prob().sum() for h in self.layers])
+        p_log_prob = self.fused_prior.log_prob() + \
+                     sum([h.prior_log_prob().sum() for h in self.unfused_layers])
 
         if self.heteroscedast:
             p_log_prob += self.dist_sigma.log_prob(self.sigma)
@@ -82,6 +95,14 @@ class BNN(nn.Module, Util_Model):
         """:returns the conditional distribution of y | X"""
         return td.Normal(self.forward(X), scale=self.sigma)
 
+    @property
+    def likelihood_scale(self):
+        return self.sigma
+
+    @property
+    def gaussian_likelihood(self):
+        return type(self).likelihood is BNN.likelihood
+
     # SURROGATE (AGGREGATING) METHODS ------------------------------------------
     def forward(self, *args, **kwargs):
         return self.layers(*args, **kwargs)
@@ -90,6 +111,57 @@ class BNN(nn.Module, Util_Model):
         for h in self.layers:
             h.update_distributions()
 
+    def refresh_distributions(self):
+        for h in self.layers:
+            h.refresh_distributions()
+
+    # ANALYTIC GRADIENTS: see Util_Model.log_prob_and_grad
+    @property
+    def analytic_grad(self):
+        return self.use_analytic_grad and type(self).forward is BNN.forward and \
+               type(self).likelihood is BNN.likelihood and \
+               type(self).my_log_prob is Util_Model.my_log_prob and \
+               all(h.analytic_layer for h in self.layers)
+
+    def analytic_forward(self, X):
+        caches = []
+        for h in self.layers:
+            X, cache = h.analytic_forward(X)
+            caches.append(cache)
+        return X, caches
+
+    def analytic_backward(self, caches, df, input_grad=True):
+        """backpropagation through the layers' analytic_backward"""
+        grads = dict()
+        for i in reversed(range(len(self.layers))):
+            df, g = self.layers[i].analytic_backward(caches[i], df, input_grad or i > 0)
+            grads.update({'layers.{}.{}'.format(i, name): v for name, v in g.items()})
+        return df, grads
+
+    def prior_grad(self):
+        return {'layers.{}.{}'.format(i, name): g
+                for i, h in enumerate(self.layers) for name, g in h.prior_grad().items()}
+
+    # STACKED (MULTI CHAIN) EXECUTION: see Util_Model.stack_states
+    def forward_stacked(self, X, states):
+        """:return: Tensor of shape (K, n, hunits[-1])"""
+        for i, h in enumerate(self.layers):
+            X = h.forward_stacked(X, self.substates(states, 'layers.{}.'.format(i)))
+        return X
+
+    def prior_log_prob_stacked(self, states):
+        """:return: Tensor of shape (K, )"""
+        p_log_prob = sum(h.prior_log_prob_stacked(self.substates(states, 'layers.{}.'.format(i)))
+                         for i, h in enumerate(self.layers))
+
+        if self.heteroscedast:
+            p_log_prob = p_log_prob + self.dist_sigma.log_prob(self.sigma)
+
+        return p_log_prob
+
+    def likelihood_stacked(self, X, states):
+        return td.Normal(self.forward_stacked(X, states), scale=self.sigma)
+
     @staticmethod
     def check_chain(chain):
         return Util_Model.check_chain_seq(chain)
@@ -5,8 +5,9 @@ import torch.nn as nn
 from Pytorch.Models.BNN import BNN
 from Pytorch.Layer.Hidden import Hidden, Hidden_flat
 from Pytorch.Layer.Group_lasso import Group_lasso
-from Pytorch.Layer.Group_HorseShoe import Group_HorseShoe
-from Pytorch.Layer.Hierarchical_Group_HorseShoe import Hierarchical_Group_HorseShoe
+from Pytorch.Layer.Group_HorseShoe import Group_HorseShoe, Group_HorseShoe_NC
+from Pytorch.Layer.Hierarchical_Group_HorseShoe import Hierarchical_Group_HorseShoe, \
+    Hierarchical_Group_HorseShoe_NC
 from Pytorch.Layer.Hierarchical_Group_lasso import Hierarchical_Group_lasso
 
 
@@ -17,6 +18,8 @@ class ShrinkageBNN(BNN):
         # 'gspike': layer.Group_SpikeNSlab,
         'ghorse': Group_HorseShoe,
         'multihorse': Hierarchical_Group_HorseShoe,
+        'ghorse_nc': Group_HorseShoe_NC,  # non-centered: W_shrinked = scale * W_raw
+        'multihorse_nc': Hierarchical_Group_HorseShoe_NC,
         'multilasso': Hierarchical_Group_lasso}
 
     layer_type = {
@@ -37,7 +40,9 @@ class ShrinkageBNN(BNN):
         :param shrinkage: 'glasso', 'gsplike', 'ghorse' each of which specifies the
         grouped shrinkage version of lasso, spike & slab & horseshoe respectively.
         See detailed doc in the respective layer. All of which assume the first variable
-        to be shrunken; i.e. provide a prior log prob model on the first column of W
+        to be shrunken; i.e. provide a prior log prob model on the first column of W.
+        'ghorse_nc' & 'multihorse_nc' are the non-centered horseshoe versions,
+        which sample standard normal weights instead of W_shrinked itself.
         :param gam_param:
         """
         if len(hunits) < 3:
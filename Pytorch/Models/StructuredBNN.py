@@ -5,6 +5,10 @@ import pandas as pd
 
 from Pytorch.Util.Util_bspline import get_design
 from Pytorch.Layer.GAM import GAM
+from Pytorch.Layer.GAM_banded import GAM_banded
+from Pytorch.Layer.GAM2D import GAM2D
+from Pytorch.Layer.GAM_additive import GAM_additive
+from Pytorch.Layer.GAM_Demmler import GAM_Demmler
 
 from Pytorch.Models.ShrinkageBNN import ShrinkageBNN
 from Pytorch.Util.Util_Model import Util_Model
@@ -18,25 +22,37 @@ matplotlib.use('agg')
 
 class StructuredBNN(nn.Module, Util_Model):
     gam_layer = {
-        'fix_nullspace': GAM
+        'fix_nullspace': GAM,
+        'banded': GAM_banded,
+        'tensor2D': GAM2D,  # bivariate smooth: Z is get_design2D of X[:, :2]
+        'additive': GAM_additive,  # gam_param=dict(no_terms=p): Z is get_design_stacked of X[:, :p]
+        'demmler': GAM_Demmler  # gam_param=dict(no_components=r) truncates the eigenbasis
     }
+    # alpha (a function of the shrinkage layer's tau) weights the gam in forward
+    prior_conditionals = False
 
     def __init__(self, hunits=[2, 3, 1], shrinkage='glasso',
                  activation=nn.ReLU(), final_activation=nn.ReLU(),
                  seperated=True, bijected=True, alpha_type='cdf',
-                 no_basis=20):
+                 no_basis=20, gam_type='fix_nullspace', gam_param={}):
+        """
+        :param gam_type: str. key of gam_layer, specifying the structured part
+        :param gam_param: dict. additional arguments to the gam_layer
+        """
         super().__init__()
         self.no_basis = no_basis
+        self.gam_type = gam_type
         self.hunits = hunits
         self.activation = activation
         self.final_activation = final_activation
         self.seperated = seperated
         self.bijected = bijected
+        self.alpha_type = alpha_type
 
         # define the model components
         self.bnn = ShrinkageBNN(hunits, activation, final_activation, shrinkage,
                                 seperated=seperated, bijected=bijected, prior='flat')
-        self.gam = self.gam_layer['fix_nullspace'](no_basis=no_basis, bijected=bijected)
+        self.gam = self.gam_layer[gam_type](no_basis=no_basis, bijected=bijected, **gam_param)
 
         # notice, that alpha automatically adapts to bijection of tau!
         self.alpha = {  # all of the below are properties!
@@ -45,10 +61,47 @@ class StructuredBNN(nn.Module, Util_Model):
             'constant': lambda: self.bnn.layers[0].alpha_const
         }[alpha_type]
 
+        # sub-models' outputs (see cached_forward)
+        self.forward_cache = {}
+
         self.reset_parameters()
 
+    @property
+    def basis(self):
+        """the gam's fitted Util_bspline.BasisTransformer"""
+        return self.gam.basis
+
+    @basis.setter
+    def basis(self, basis):
+        self.gam.basis = basis
+
     def forward(self, X, Z):
-        return self.bnn.forward(X) + self.alpha() * self.gam.forward(Z)
+        return self.cached_forward('bnn', X) + self.alpha() * self.cached_forward('gam', Z)
+
+    def cached_forward(self, name, X):
+        """
+        forward of the sub-model 'bnn' or 'gam', whose output is reused as long
+        as neither its parameters nor X changed, keyed on their version counters
+        (and storages). Under block or Gibbs style updates, merely the moving
+        sub-model is recomputed. Only outputs without an autograd graph are
+        cached: with trainable parameters under grad mode, each backward
+        requires its own graph. Notice, that in place changes, which bypass the
+        version counter (p.data.copy_), are not detected.
+        """
+        module = getattr(self, name)
+        params = list(module.parameters())
+        if torch.is_grad_enabled() and any(p.requires_grad for p in params):
+            return module.forward(X)
+
+        key = [(p.data_ptr(), p._version) for p in params]
+        cache = self.forward_cache.get(name, None)
+        if cache is not None and cache['X'] is X and cache['X_version'] == X._version and \
+                cache['key'] == key:
+            return cache['out']
+
+        out = module.forward(X)
+        self.forward_cache[name] = {'X': X, 'X_version': X._version, 'key': key, 'out': out}
+        return out
 
     def prior_log_prob(self):
         """surrogate for the hidden layers' prior log prob"""
@@ -59,9 +112,15 @@ class StructuredBNN(nn.Module, Util_Model):
         the bspline extension desing marix"""
         return td.Normal(self.forward(X, Z), sigma)
 
+    @property
+    def gaussian_likelihood(self):
+        return type(self).likelihood is StructuredBNN.likelihood
+
     def log_prob(self, X, Z, y):
-        self.update_distributions()
-        return self.prior_log_prob() + self.likelihood(X, Z).log_prob(y).sum()
+        self.refresh_distributions()
+        if self.chunked(X, Z, y):
+            return self.chunked_log_prob(X, Z, y)
+        return self.prior_log_prob() + self.log_likelihood(X, Z, y)
 
     def reset_parameters(self, seperated=False, **kwargs):
         # Resample the BNN part
@@ -73,6 +132,29 @@ class StructuredBNN(nn.Module, Util_Model):
         self.gam.update_distributions()
         self.bnn.update_distributions()
 
+    def refresh_distributions(self):
+        self.gam.refresh_distributions()
+        self.bnn.refresh_distributions()
+
+    # STACKED (MULTI CHAIN) EXECUTION: see Util_Model.stack_states
+    def alpha_stacked(self, states):
+        """alpha of K stacked states: Tensor broadcastable to (K, n, 1)"""
+        if self.alpha_type == 'cdf':
+            return self.bnn.layers[0].alpha_stacked(self.substates(states, 'bnn.layers.0.'))
+        elif self.alpha_type == 'constant':
+            return self.bnn.layers[0].alpha_const
+        raise NotImplementedError('alpha_type {} has no stacked version'.format(self.alpha_type))
+
+    def forward_stacked(self, X, Z, states):
+        """:return: Tensor of shape (K, n, 1)"""
+        return self.bnn.forward_stacked(X, self.substates(states, 'bnn.')) + \
+               self.alpha_stacked(states) * self.gam.forward_stacked(Z, self.substates(states, 'gam.'))
+
+    def prior_log_prob_stacked(self, states):
+        """:return: Tensor of shape (K, )"""
+        return self.bnn.prior_log_prob_stacked(self.substates(states, 'bnn.')) + \
+               self.gam.prior_log_prob_stacked(self.substates(states, 'gam.'))
+
     @torch.no_grad()
     def _predict_states(self, X, Z, chain=None):
         """
@@ -95,26 +177,36 @@ class StructuredBNN(nn.Module, Util_Model):
 
         # predict current state
         df['current'] = self.forward(X, Z).view(X.shape[0], ).numpy()
-        df_gam['current'] = self.gam.forward(Z).view(X.shape[0], ).numpy()
+        df_gam['current'] = self.cached_forward('gam', Z).view(X.shape[0], ).numpy()
         current = deepcopy(self.state_dict())
 
         # predict true model
         self.load_state_dict(self.true_model)
         df['true'] = self.forward(X, Z).view(X.shape[0], ).numpy()
-        df_gam['true'] = self.gam.forward(Z).view(X.shape[0], ).numpy()
+        df_gam['true'] = self.cached_forward('gam', Z).view(X.shape[0], ).numpy()
 
         # predict true model
         if hasattr(self, 'init_model'):
             self.load_state_dict(self.init_model)
             df['init'] = self.forward(X, Z).view(X.shape[0], ).numpy()
-            df_gam['init'] = self.gam.forward(Z).view(X.shape[0], ).numpy()
+            df_gam['init'] = self.cached_forward('gam', Z).view(X.shape[0], ).numpy()
 
         # predict chain
-        if chain is not None:
+        if chain is not None and self.alpha_type != 'Be':
+            # all states at once
+            self.load_state_dict(current)
+            states = self.stack_states(chain)
+            f = self.forward_stacked(X, Z, states)
+            f_gam = self.gam.forward_stacked(Z, self.substates(states, 'gam.'))
+            for i in range(len(chain)):
+                df[str(i)] = f[i].view(X.shape[0], ).numpy()
+                df_gam[str(i)] = f_gam[i].view(X.shape[0], ).numpy()
+
+        elif chain is not None:
             for i, c in enumerate(chain):
                 self.load_state_dict(c)
                 df[str(i)] = self.forward(X, Z).view(X.shape[0], ).numpy()
-                df_gam[str(i)] = self.gam.forward(Z).view(X.shape[0], ).numpy()
+                df_gam[str(i)] = self.cached_forward('gam', Z).view(X.shape[0], ).numpy()
 
             # return to current state
             self.load_state_dict(current)
@@ -180,6 +272,19 @@ if __name__ == '__main__':
     y = h.likelihood(X, Z).sample()
     # h.plot(X, Z, y) # Fixme: canvas fails
 
+    # incremental refresh_distributions: a log_prob under grad mode, which follows
+    # a no_grad one (e.g. a sampler's logging) must yield the full refresh's gradients
+    with torch.no_grad():
+        h.log_prob(X, Z, y)
+    h.log_prob(X, Z, y).backward()
+    grads = [p.grad.clone() for p in h.parameters() if p.grad is not None]
+    h.zero_grad()
+    h.update_distributions()
+    h.log_prob(X, Z, y).backward()
+    assert all(torch.allclose(g, p.grad) for g, p in zip(grads, [p for p in h.parameters() if p.grad is not None])), \
+        'stale distributions after no_grad log_prob'
+    h.zero_grad()
+
     # check sampling ability.
     from Pytorch.Samplers.mygeoopt import myRHMC, mySGRHMC, myRSGLD
     from torch.utils.data import TensorDataset, DataLoader
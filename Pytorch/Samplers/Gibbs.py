@@ -0,0 +1,307 @@
+import math
+import numpy as np
+import torch
+from copy import deepcopy
+from scipy.linalg import cholesky_banded, cho_solve_banded
+from tqdm import tqdm
+
+from Pytorch.Samplers.Util_Samplers import Util_Sampler
+from Pytorch.Layer.GAM import GAM
+from Pytorch.Util.Util_bspline import diff_mat1D
+
+
+def slice_sample(log_prob, x0, width=1., max_steps=50):
+    """
+    slice sampler with stepping out & shrinkage (Neal, 2003) for a tensor of
+    conditionally independent coordinates; an exact (tuning free) MCMC update
+    of the density exp(log_prob)
+
+    :param log_prob: function: Tensor -> Tensor. elementwise unnormalized log
+    densities of the coordinates
+    :param x0: Tensor. current state
+    :param width: float. initial width of the brackets
+    :param max_steps: int. maximal number of stepping out steps per side
+    :return: Tensor. new state
+    """
+    level = log_prob(x0) + torch.log(1 - torch.rand_like(x0))  # log(U * p(x0))
+
+    # stepping out
+    left = x0 - width * torch.rand_like(x0)
+    right = left + width
+    j = (max_steps * torch.rand_like(x0)).long()
+    k = max_steps - 1 - j
+    out = (j > 0) & (log_prob(left) > level)
+    while out.any():
+        left = torch.where(out, left - width, left)
+        j = j - out.long()
+        out = (j > 0) & (log_prob(left) > level)
+    out = (k > 0) & (log_prob(right) > level)
+    while out.any():
+        right = torch.where(out, right + width, right)
+        k = k - out.long()
+        out = (k > 0) & (log_prob(right) > level)
+
+    # shrinkage
+    x1 = x0.clone()
+    todo = torch.ones_like(x0, dtype=torch.bool)
+    while todo.any():
+        proposal = left + (right - left) * torch.rand_like(x0)
+        accept = todo & (log_prob(proposal) > level)
+        x1 = torch.where(accept, proposal, x1)
+        todo = todo & ~accept
+        left = torch.where(todo & (proposal < x0), proposal, left)
+        right = torch.where(todo & (proposal >= x0), proposal, right)
+    return x1
+
+
+def to_banded(A, bandwidth):
+    """lower banded storage ab[i, j] = A[i + j, j] of a symmetric (dense or
+    scipy.sparse) matrix A, as expected by scipy.linalg.cholesky_banded"""
+    return np.stack([np.pad(A.diagonal(-i), (0, i)) for i in range(bandwidth + 1)])
+
+
+class Gibbs_GAM(Util_Sampler):
+    def __init__(self, model, width=1.):
+        """
+        Blocked Gibbs sampler for GAM's conditionally conjugate posterior
+        (no tuning grid required):
+        W | tau, y ~ MVN(P^-1 Z^T y, P^-1) with precision P = Z^T Z + tau^-2 penK
+        is drawn exactly based on the model's sufficient statistics. The proper
+        penK = K + V_0 diag(d) V_0^T is the banded difference penalty K plus a low
+        rank correction of K's nullspace V_0 (see GAM.define_proper_cov); as the
+        local B-spline bases make Z^T Z banded as well, P is factorized by a banded
+        Cholesky decomposition and the correction is applied by the Woodbury
+        identity, i.e. O(no_basis) per step independent of n.
+        As tau is the scale of W with a Gamma prior, tau | W is not Gamma; it is
+        drawn by an exact slice sampling update of the model's own prior_log_prob
+        on tau's unconstrained (log) scale.
+
+        :param model: GAM (or GAM_banded) with identity activation
+        :param width: initial bracket width of tau's slice sampler (on log scale)
+        """
+        if not (isinstance(model, GAM) and model.linear_gaussian and
+                type(model).prior_log_prob is GAM.prior_log_prob):
+            raise ValueError('Gibbs_GAM requires a GAM with identity activation '
+                             'and the random walk prior of GAM.prior_log_prob')
+        Util_Sampler.__init__(self, model)
+        self.width = width
+
+        # proper prior precision of W: penK = K + null_vec diag(null_val) null_vec^T
+        self.K = diff_mat1D(model.no_basis, model.order, sparse=True)[1]
+        self.null_vec = model.null_vec.double().numpy()
+        null_val = np.broadcast_to(np.asarray(model.null_val, dtype=np.float64), self.null_vec.shape[1:])
+        if (null_val < -1e-8).any():
+            raise ValueError('Gibbs_GAM requires a proper penK, which raises (not lowers) K\'s eigenvalues')
+        self.null_val = null_val.clip(0)  # up to rounding
+
+    def __str__(self):
+        return 'Gibbs_GAM'
+
+    def set_up_precision(self):
+        """banded storage of the sufficient statistics' Z^T Z (its bandwidth is the
+        B-spline degree) and K, padded to their common bandwidth"""
+        s = self.model.suff_stat
+        XtX = s['XtX'].numpy()
+        bandwidth = max([self.model.order] + [i for i in range(1, len(XtX)) if XtX.diagonal(-i).any()])
+        self.XtX_ab = to_banded(XtX, bandwidth)
+        self.K_ab = to_banded(self.K, bandwidth)
+        self.Xty = s['Xty'].numpy()
+
+    @torch.no_grad()
+    def sample_W(self):
+        tau = self.model.tau.exp() if self.model.bijected else self.model.tau
+        prec = float(tau) ** -2
+        # P = B + U U^T with the banded B = Z^T Z + tau^-2 K & U = tau^-1 null_vec diag(null_val)^1/2
+        L = cholesky_banded(self.XtX_ab + prec * self.K_ab, lower=True)
+        U = self.null_vec * np.sqrt(prec * self.null_val)
+
+        # v = Z^T y + L e + U e0 ~ N(Z^T y, P), such that P^-1 v ~ N(P^-1 Z^T y, P^-1)
+        e = torch.randn(self.Xty.shape, dtype=torch.float64).numpy()
+        e0 = torch.randn(U.shape[1], e.shape[1], dtype=torch.float64).numpy()
+        v = self.Xty + U @ e0
+        for i in range(len(L)):
+            v[i:] += L[i, :len(e) - i, None] * e[:len(e) - i]
+
+        # Woodbury: P^-1 v = B^-1 v - B^-1 U (I + U^T B^-1 U)^-1 U^T B^-1 v
+        Bv, BU = cho_solve_banded((L, True), v), cho_solve_banded((L, True), U)
+        W = Bv - BU @ np.linalg.solve(np.eye(U.shape[1]) + U.T @ BU, U.T @ Bv)
+        self.model.W.data = torch.from_numpy(W).float()
+
+    def tau_log_prob(self, u):
+        """log density of tau | W on log scale u (W's prior is tau's sole dependence)"""
+        model = self.model
+        model.tau.data = u if model.bijected else u.exp()
+        model.update_distributions()
+        # jacobian of tau = exp(u), if tau is not already bijected
+        return model.prior_log_prob() + (0. if model.bijected else u)
+
+    @torch.no_grad()
+    def sample_tau(self):
+        u = self.model.tau.data if self.model.bijected else self.model.tau.data.log()
+        self.tau_log_prob(slice_sample(self.tau_log_prob, u, self.width))
+
+    def sample(self, trainloader, burn_in, n_samples):
+        """
+        :param trainloader: full batch DataLoader (of Z, y)
+        :param burn_in: number of burnin sweeps
+        :param n_samples: number of collected samples (sweeps)
+        :return: list of state_dicts (OrderedDicts) representing each state of the model
+        """
+        if trainloader.batch_size != len(trainloader.dataset):
+            raise ValueError('trainloader for non-SG Sampler must use the entire dataset at each step'
+                             ' set trainloader.batch_size = len(trainloader.dataset')
+
+        data = next(trainloader.__iter__())
+        if not self.model.uses_suff_stat(*data):
+            self.model.sufficient_statistics(*data)
+        self.set_up_precision()
+
+        print('Burn-in')
+        for _ in tqdm(range(burn_in)):
+            self.sample_W()
+            self.sample_tau()
+
+        print('\nSampling')
+        self.chain = list()
+        self.log_probs = list()
+        for _ in tqdm(range(n_samples)):
+            self.sample_W()
+            self.sample_tau()
+
+            self.chain.append(deepcopy(self.model.state_dict()))
+            with torch.no_grad():
+                self.log_probs.append(self.model.log_prob(*data).item())
+
+        self.model.check_chain(self.chain)
+        self.log_probs = torch.tensor(self.log_probs)
+
+        return self.chain
+
+
+class Metropolis_within_Gibbs(Util_Sampler):
+    def __init__(self, model, epsilon, L=1, width=1.):
+        """
+        Metropolis within Gibbs sampler for models with shrinkage layers (e.g.
+        Group_lasso, Hierarchical_Group_lasso, Group_HorseShoe): each sweep
+        alternates exact draws of the layers' hyperparameters (layer.conditionals)
+        from their full conditionals (layer.conditional_log_prob) with an HMC
+        move (MALA for L=1) on all remaining parameters given the hyperparameters.
+        Decoupling the weights from their scales removes the funnel, which
+        otherwise forces gradient samplers to collapse their step size.
+        As tau is a scale with a Gamma prior (see Util_Prior.group_lasso_log_prob),
+        its conditional is not inverse Gaussian; the conditionals are drawn by
+        an exact slice sampling update instead.
+
+        :param model: model, which has at least one layer with conditionals and
+        whose conditionals enter the prior only (see Util_Model.prior_conditionals)
+        :param epsilon: float. HMC step size of the weights
+        :param L: int. number of leapfrog steps
+        :param width: initial bracket width of the slice sampler (on log scale)
+        """
+        if not model.prior_conditionals:
+            raise ValueError('Metropolis_within_Gibbs requires a model, whose conditionals enter the '
+                             'prior only (e.g. not StructuredBNN, whose alpha depends on tau)')
+        Util_Sampler.__init__(self, model)
+        self.epsilon = epsilon
+        self.L = L
+        self.width = width
+
+        self.layers = {name: m for name, m in model.named_modules() if getattr(m, 'conditionals', ())}
+        if not self.layers:
+            raise ValueError('Metropolis_within_Gibbs requires a model with a layer, '
+                             'which has conditionals (e.g. Group_lasso)')
+
+        hyper = [id(getattr(m, c)) for m in self.layers.values() for c in m.conditionals]
+        self.weights = [p for p in model.parameters() if id(p) not in hyper]
+        self.accepted = 0
+
+    def __str__(self):
+        return 'MwG'
+
+    @torch.no_grad()
+    def sample_conditionals(self):
+        for layer in self.layers.values():
+            for name in layer.conditionals:
+                x = getattr(layer, name)
+
+                def log_prob(u):
+                    # slice on log scale u, which (if not bijected) adds tau = exp(u)'s jacobian
+                    if layer.bijected:
+                        return layer.conditional_log_prob(name, u)
+                    return layer.conditional_log_prob(name, u.exp()) + u
+
+                u = x.data if layer.bijected else x.data.log()
+                u = slice_sample(log_prob, u, self.width)
+                x.copy_(u if layer.bijected else u.exp())  # bumps x._version
+                layer.update_distributions()
+
+    def log_prob_and_grad(self, data):
+        """model's log_prob & its gradients w.r.t. self.weights"""
+        with torch.enable_grad():
+            value = self.model.log_prob(*data)
+            grads = torch.autograd.grad(value, self.weights, allow_unused=True)
+        return value.detach(), [torch.zeros_like(p) if g is None else g
+                                for p, g in zip(self.weights, grads)]
+
+    @torch.no_grad()
+    def sample_weights(self, data):
+        """HMC step on self.weights with Metropolis Hastings correction"""
+        x0 = [p.detach().clone() for p in self.weights]
+        value0, grads = self.log_prob_and_grad(data)
+
+        r0 = [torch.randn_like(p) for p in self.weights]
+        r = [ri + self.epsilon / 2 * g for ri, g in zip(r0, grads)]
+        for l in range(self.L):
+            for p, ri in zip(self.weights, r):
+                p.add_(self.epsilon * ri)
+            value, grads = self.log_prob_and_grad(data)
+            step = self.epsilon if l < self.L - 1 else self.epsilon / 2
+            r = [ri + step * g for ri, g in zip(r, grads)]
+
+        log_accept = value - value0 + 0.5 * (sum((ri ** 2).sum() for ri in r0) -
+                                             sum((ri ** 2).sum() for ri in r))
+        if torch.isfinite(log_accept) and math.log(1 - torch.rand(1).item()) < log_accept.item():
+            self.accepted += 1
+        else:
+            for p, x in zip(self.weights, x0):
+                p.copy_(x)
+
+    def sample(self, trainloader, burn_in, n_samples):
+        """
+        :param trainloader: full batch DataLoader
+        :param burn_in: number of burnin sweeps
+        :param n_samples: number of collected samples (sweeps)
+        :return: list of state_dicts (OrderedDicts) representing each state of the model
+        """
+        if trainloader.batch_size != len(trainloader.dataset):
+            raise ValueError('trainloader for non-SG Sampler must use the entire dataset at each step'
+                             ' set trainloader.batch_size = len(trainloader.dataset')
+
+        data = next(trainloader.__iter__())
+
+        print('Burn-in')
+        for _ in tqdm(range(burn_in)):
+            self.sample_conditionals()
+            self.sample_weights(data)
+
+        print('\nSampling')
+        self.accepted = 0
+        self.chain = list()
+        self.hyper_chain = list()  # hyperparameters, which are no nn.Parameter (e.g. Group_lasso.lamb)
+        self.log_probs = list()
+        for _ in tqdm(range(n_samples)):
+            self.sample_conditionals()
+            self.sample_weights(data)
+
+            self.chain.append(deepcopy(self.model.state_dict()))
+            self.hyper_chain.append({'{}.{}'.format(name, c): getattr(m, c).clone()
+                                     for name, m in self.layers.items() for c in m.conditionals
+                                     if not isinstance(getattr(m, c), torch.nn.Parameter)})
+            with torch.no_grad():
+                self.log_probs.append(self.model.log_prob(*data).item())
+
+        self.acceptance_rate = self.accepted / n_samples
+        self.model.check_chain(self.chain)
+        self.log_probs = torch.tensor(self.log_probs)
+
+        return self.chain
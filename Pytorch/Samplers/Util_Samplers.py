@@ -28,12 +28,19 @@ class Util_Sampler:
 
         with open(path + '.sampler_pkl', "wb") as output_file:
             d = {'chain': self.chain, 'true_model': self.model.true_model, 'init_model': self.model.init_model}
+            if getattr(self.model, 'basis', None) is not None:
+                d['basis'] = self.model.basis.state_dict()
             pickle.dump(d, output_file)
 
     def load(self, path):
         import pickle
         with open(path + '.sampler_pkl', "rb") as input_file:
-            self.chain = pickle.load(input_file)['chain']
+            d = pickle.load(input_file)
+            self.chain = d['chain']
+
+        if 'basis' in d.keys():
+            from Pytorch.Util.Util_bspline import BasisTransformer
+            self.model.basis = BasisTransformer().load_state_dict(d['basis'])
 
         self.model.load_state_dict(torch.load(path + '.model'))
 
@@ -1,2 +1,3 @@
 from Pytorch.Samplers.LudwigWinkler import MALA, SGLD, SGNHT # could also be HMC
 from Pytorch.Samplers.mygeoopt import myRHMC, myRSGLD, mySGRHMC
+from Pytorch.Samplers.Gibbs import Gibbs_GAM, Metropolis_within_Gibbs
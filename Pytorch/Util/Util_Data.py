@@ -0,0 +1,90 @@
+import torch
+from torch.utils.data import Dataset, IterableDataset
+
+from Pytorch.Util.Util_bspline import eval_design
+from Pytorch.Util.Util_Sparse import to_sparse_tensor
+
+
+class FullBatch(Dataset):
+    def __init__(self, *tensors):
+        """
+        Dataset of the non-SG samplers, whose single item is the full batch: the
+        tensors themselves rather than a collated copy (the order of the
+        observations is irrelevant to the full batch log_prob). Consequently,
+        each step costs O(1) independent of n (no per observation indexing), and
+        state keyed on the data's identity applies in each step; e.g. the
+        sufficient statistics of Hidden.sufficient_statistics(*tensors).
+        Notice, batch_size = len(trainset) = 1 as required by the non-SG samplers.
+
+        trainset = FullBatch(X, y)
+        trainloader = DataLoader(trainset, batch_size=len(trainset), collate_fn=trainset.collate)
+
+        :param tensors: torch.Tensor (dense or sparse); all of the same first dimension.
+        """
+        if any(t.shape[0] != tensors[0].shape[0] for t in tensors):
+            raise ValueError('Size mismatch between tensors')
+        self.tensors = tensors
+
+    def __getitem__(self, index):
+        return self.tensors
+
+    def __len__(self):
+        return 1
+
+    @staticmethod
+    def collate(batch):
+        return batch[0]
+
+
+class BsplineStream(IterableDataset):
+    def __init__(self, X, y, basis, column=None, batch_size=100, shuffle=True, sparse=False):
+        """
+        Minibatch stream, that evaluates the bspline design of each batch on
+        demand from a fitted basis, such that the (n, no_basis) design matrix
+        is never held in memory. Intended for the SG samplers, which draw
+        one batch per step via next(trainloader.__iter__()); hence, use it with
+        automatic batching disabled:
+
+        trainloader = DataLoader(BsplineStream(X, y, basis, batch_size=100), batch_size=None)
+
+        :param X: Tensor. covariate(s)
+        :param y: Tensor. response
+        :param basis: fitted Util_bspline.BasisTransformer
+        :param column: int or None. if None, X is the (n,) covariate of a GAM
+        and batches are (Z, y). Otherwise, Z is the design of X[:, column] and
+        batches are (X, Z, y) as in StructuredBNN.
+        :param batch_size: number of observations per batch
+        :param shuffle: bool. whether the observations are drawn in random order
+        :param sparse: bool. whether Z is a torch sparse tensor
+        """
+        if basis.knots is None:
+            raise RuntimeError('BsplineStream requires a fitted basis')
+
+        self.X = X
+        self.y = y
+        self.basis = basis
+        self.column = column
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.sparse = sparse
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def design(self, X):
+        """:returns the design of the covariate X (1dim Tensor) on the fitted knots"""
+        Z = eval_design(X.numpy(), knots=self.basis.knots, degree=self.basis.degree, sparse=self.sparse)
+        if self.sparse:
+            return to_sparse_tensor(Z)
+        return torch.tensor(Z, dtype=torch.float32)
+
+    def __iter__(self):
+        n = len(self)
+        index = torch.randperm(n) if self.shuffle else torch.arange(n)
+        for i in range(0, n, self.batch_size):
+            batch = index[i:i + self.batch_size]
+            X, y = self.X[batch], self.y[batch]
+            if self.column is None:
+                yield self.design(X), y
+            else:
+                yield X, self.design(X[:, self.column]), y
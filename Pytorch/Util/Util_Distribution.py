@@ -144,6 +144,22 @@ class LogTransform(td.Transform):
         return 1 / x  # todo check it is not 1/y
 
 
+def set_validate_args(value):
+    """
+    global switch of torch.distributions' argument validation for all
+    distributions constructed afterwards (e.g. by update_distributions or
+    likelihood). Validation checks each argument's constraint on every
+    construction; once a model is known to be well specified, disabling it
+    removes that overhead from the sampler loop.
+
+    :param value: bool. whether to validate the arguments
+    :return: bool. the previous setting, to restore it afterwards
+    """
+    previous = td.Distribution._validate_args
+    td.Distribution.set_default_validate_args(value)
+    return previous
+
+
 if __name__ == '__main__':
     samples = 2
     seed = 1
@@ -1,11 +1,72 @@
 import torch
+import torch.nn as nn
 import torch.distributions as td
 from Pytorch.Util.Util_Plots import Util_plots
+from Pytorch.Util.Util_Sparse import is_sparse
 
+import math
 from math import prod
 
+# normalizing constant of the standard normal density: log(sqrt(2 pi))
+LOG_SQRT_2PI = 0.5 * math.log(2 * math.pi)
+
+
+class Log_posterior(nn.Module):
+    def __init__(self, model):
+        """module wrapper of model.log_prob(X, y), registering the model's
+        parameters such that torch.jit.trace treats them as such (and not as
+        constants of the graph); see Util_Model.compile_log_prob"""
+        super().__init__()
+        self.model = model
+
+    def forward(self, X, y):
+        # log_prob's autograd path (the analytic one is opaque to the tracer)
+        if hasattr(self.model, 'update_distributions'):
+            self.model.update_distributions()
+        return self.model.my_log_prob(X, y)
+
+
+class AnalyticLogProb(torch.autograd.Function):
+    """log_prob, whose gradients are computed alongside its value by the
+    model's gradient kernels (see Util_Model.log_prob_and_grad) rather than
+    by recording an autograd graph. backward merely hands them out, such that
+    the samplers' log_prob(...).backward() remains unchanged."""
+
+    @staticmethod
+    def forward(ctx, model, X, y, *params):
+        value, ctx.grads = model.log_prob_and_grad(X, y)
+        return value
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        return (None, None, None) + tuple(None if g is None else grad_output * g for g in ctx.grads)
+
+
+class ChunkedLogProb(torch.autograd.Function):
+    """full batch log_prob, which is evaluated in chunks of rows (see
+    Util_Model.chunk_size); each chunk's autograd graph is freed as soon as its
+    gradients are accumulated (see Util_Model.chunked_log_prob_and_grad), such
+    that the peak memory is O(chunk_size) rather than O(n). backward merely
+    hands out the accumulated gradients."""
+
+    @staticmethod
+    def forward(ctx, model, data, *params):
+        value, ctx.grads = model.chunked_log_prob_and_grad(*data)
+        return value
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        return (None, None) + tuple(None if g is None else grad_output * g for g in ctx.grads)
+
 
 class Util_Model(Util_plots):
+    # switch for the analytic gradient path of log_prob (see analytic_grad)
+    use_analytic_grad = True
+    # whether the hyperparameters with full conditionals of the model's layers
+    # (see Group_lasso.conditionals) enter the prior only. If they enter forward,
+    # their full conditional involves the likelihood, which the layers'
+    # conditional_log_prob omits (see Metropolis_within_Gibbs)
+    prior_conditionals = True
 
     @property
     def p_names(self):
@@ -16,22 +77,169 @@ class Util_Model(Util_plots):
 
     @property
     def parameters_dict(self):
-        # print(self)
-        return {name: self.get_param(name) for name in self.p_names}
+        return dict(self.named_parameters())
+
+    def flatten_parameters(self):
+        """
+        store all of the object's parameters in a single contiguous 1d tensor
+        self.flat, making each nn.Parameter a view into it (the parameters
+        remain the same objects, so their .dist/.distrib attributes are kept).
+        Consequently, vec is a single copy & a new state can be loaded with a
+        single (fused) op via load_vec or in place ops on self.flat.
+        Notice, that assigning p.data (e.g. in reset_parameters) detaches p
+        from the buffer; in that case, the model falls back to the
+        per parameter methods until flatten_parameters is called again.
+
+        :return: the flat buffer self.flat
+        """
+        params = list(self.parameters())
+        flat = torch.cat([p.data.reshape(-1) for p in params])
+
+        offset = 0
+        for p in params:
+            p.data = flat[offset: offset + p.nelement()].view_as(p)
+            offset += p.nelement()
+
+        self.flat = flat
+        self._flat_ptrs = [(p, p.data_ptr()) for p in params]
+        return flat
+
+    @property
+    def is_flat(self):
+        """whether all parameters are (still) views into self.flat"""
+        if self.__dict__.get('flat', None) is None:
+            return False
+        return all(p.data_ptr() == ptr for p, ptr in self._flat_ptrs)
 
     @property
     def vec(self):
         """vectorize provides the view of all of the object's parameters in form
         of a single vector. essentially it is hamiltorch.util.flatten, but without
-        dependence to the nn.Parameters. instead it works on the """
-        return torch.cat([self.get_param(name).view(
-            self.get_param(name).nelement())
-            for name in self.p_names])
+        dependence to the nn.Parameters. If the parameters are flattened (see
+        flatten_parameters), it is a copy of the flat buffer."""
+        if self.is_flat:
+            return self.flat.clone()
+        return torch.cat([p.view(p.nelement()) for p in self.parameters()])
+
+    @torch.no_grad()
+    def load_vec(self, vec):
+        """inplace counterpart of vec: set all parameters from a single vector"""
+        if self.is_flat:
+            self.flat.copy_(vec)
+            return None
+
+        offset = 0
+        for p in self.parameters():
+            p.copy_(vec[offset: offset + p.nelement()].view_as(p))
+            offset += p.nelement()
 
     # LOG-PROB related
     def update_distributions(self):
         raise NotImplementedError('update_distribution function must be specified')
 
+    # INCREMENTAL UPDATE_DISTRIBUTIONS
+    # dependency DAG of the conditional distributions, declared in define_model:
+    # {name of a distribution (key of self.dist or parameter with .dist) or of a
+    # derived tensor (e.g. GAM.tau_bij): names of the tensors, it is computed from}.
+    # None declares nothing, such that update_distributions is always invoked
+    dist_parents = None
+
+    def refresh_distributions(self):
+        """
+        incremental update_distributions (see log_prob): the conditional
+        distributions are recomputed only if one of their parents (dist_parents)
+        changed its value since the last refresh - or under grad mode, if they
+        carry an autograd graph, which each backward requires anew, or if
+        they were computed under no_grad (lacking the graph, they would silently
+        drop the hyperparameters' gradients).
+        Notice, that dist_parents merely gates the layer's entire
+        update_distributions; the distributions are not refreshed individually.
+        """
+        if self.dist_parents is None:
+            return self.update_distributions()
+        elif not self.dist_parents:
+            return None
+
+        names = sorted({name for parents in self.dist_parents.values() for name in parents})
+        parents = [getattr(self, name) for name in names]
+        state = self.__dict__.get('dist_state', None)
+        if state is not None and not (torch.is_grad_enabled() and (state['graph'] or not state['grad_mode'])) and \
+                all(torch.equal(p, s) for p, s in zip(parents, state['parents'])):
+            return None
+
+        self.update_distributions()
+        self.dist_state = {'parents': [p.detach().clone() for p in parents],
+                           'grad_mode': torch.is_grad_enabled(),
+                           'graph': any(t.grad_fn is not None for t in self.dist_tensors())}
+
+    def dist_tensors(self):
+        """all tensors of the distributions (& derived tensors) in dist_parents"""
+        dists = self.__dict__.get('dist', {})
+        todo = [dists[name] if name in dists else getattr(self, name) for name in self.dist_parents]
+        tensors = []
+        while todo:
+            obj = todo.pop()
+            if isinstance(getattr(obj, 'dist', None), td.Distribution):  # parameter with .dist
+                todo.append(obj.dist)
+            elif isinstance(obj, torch.Tensor):
+                tensors.append(obj)
+            elif isinstance(obj, td.Distribution):
+                todo.extend(vars(obj).values())
+        return tensors
+
+    # CHUNKED FULL BATCH LOG_PROB
+    # number of rows, in which the likelihood of a full batch is evaluated
+    # (see chunked_log_prob). None evaluates all rows at once
+    chunk_size = None
+
+    def chunked(self, *data):
+        """whether log_prob evaluates data (e.g. X, y) in chunks"""
+        return self.chunk_size is not None and data[-1].shape[0] > self.chunk_size
+
+    def chunks(self, *data):
+        """:returns iterator of tuples of the data's consecutive chunks of chunk_size rows"""
+        n = data[-1].shape[0]
+        for start in range(0, n, self.chunk_size):
+            length = min(self.chunk_size, n - start)
+            yield tuple(d.narrow_copy(0, start, length) if is_sparse(d) else d.narrow(0, start, length)
+                        for d in data)
+
+    def chunked_log_prob(self, *data):
+        """
+        log_prob of the full batch data (e.g. X, y), whose likelihood is
+        evaluated in chunks, such that at most one chunk's forward pass
+        (and autograd graph) is alive at once. The value & gradients are those of
+        the single pass (up to the order of summation).
+        """
+        if torch.is_grad_enabled():
+            return ChunkedLogProb.apply(self, data, *self.parameters())
+        return sum(self.log_prob_terms(*data))
+
+    def log_prob_terms(self, *data):
+        """lazily evaluated summands of log_prob: prior_log_prob & each chunk's log likelihood"""
+        yield self.prior_log_prob()
+        for *X, y in self.chunks(*data):
+            yield self.log_likelihood(*X, y)
+
+    def chunked_log_prob_and_grad(self, *data):
+        """
+        :return: tuple: value, list of gradients aligned with self.parameters()
+        (None for those, that do not require grad) of log_prob_terms, each of
+        which is differentiated & freed before the next one is evaluated.
+        """
+        params = [p for p in self.parameters() if p.requires_grad]
+        grads = dict()
+        value = 0.
+        with torch.enable_grad():
+            for term in self.log_prob_terms(*data):
+                if term.requires_grad:
+                    for p, g in zip(params, torch.autograd.grad(term, params, allow_unused=True)):
+                        if g is not None:
+                            grads[p] = grads.get(p, 0.) + g
+                value = value + term.detach()
+
+        return value, [grads.get(p) for p in self.parameters()]
+
     def likelihood(self, X):
         """:returns the conditional distribution of y | X"""
         # TODO update likelihood to become an attribute distribution,
@@ -39,24 +247,165 @@ class Util_Model(Util_plots):
         #  or even use self.likelihood.loc = newloc
         return td.Normal(self.forward(X), scale=torch.tensor(1.))
 
+    # FUSED GAUSSIAN LIKELIHOOD
+    # (fixed) scale of the Gaussian likelihood; e.g. BNN's sigma
+    likelihood_scale = 1.
+
+    @property
+    def gaussian_likelihood(self):
+        """whether likelihood is td.Normal(forward, likelihood_scale), in which case
+        log_likelihood bypasses its construction (see gaussian_log_likelihood)"""
+        return type(self).likelihood is Util_Model.likelihood
+
+    def log_likelihood(self, *data):
+        """
+        likelihood(*X).log_prob(y).sum() of data = (*X, y). The Gaussian
+        likelihood is fused: likelihood() remains a distribution e.g. to
+        sample data, but the samplers' log_prob does not construct (& validate)
+        a td.Normal on each call.
+        """
+        *X, y = data
+        if self.gaussian_likelihood:
+            return self.gaussian_log_likelihood(self.forward(*X), y, self.likelihood_scale)
+        return self.likelihood(*X).log_prob(y).sum()
+
+    @staticmethod
+    def gaussian_rss_log_prob(r, scale=1.):
+        """
+        :param r: Tensor. residuals y - mu
+        :param scale: float or Tensor. the constants of a float scale are computed in python
+        :returns td.Normal(mu, scale).log_prob(y).sum() with the residual sum of
+        squares in a single reduction
+        """
+        r = r.reshape(-1)
+        rss = torch.dot(r, r)
+        if isinstance(scale, torch.Tensor):
+            value = - 0.5 * rss / scale ** 2 - r.nelement() * (torch.log(scale) + LOG_SQRT_2PI)
+            return value.sum()
+        return - 0.5 / scale ** 2 * rss - r.nelement() * (math.log(scale) + LOG_SQRT_2PI)
+
+    @staticmethod
+    def gaussian_log_likelihood(mu, y, scale=1.):
+        """:returns td.Normal(mu, scale).log_prob(y).sum() (see gaussian_rss_log_prob)"""
+        return Util_Model.gaussian_rss_log_prob(y - mu, scale)
+
     def my_log_prob(self, X, y):
         """Default "user-specified" log_prob function, that assumes
          class hast prior_log_prob() and likelihood(mu=f(X)) function.
          my_log_prob function is subjected to self.log_prob function, which in
          turn is subjected to a sampler"""
-        return self.prior_log_prob() + \
-               self.likelihood(X).log_prob(y).sum()
+        return self.prior_log_prob() + self.log_likelihood(X, y)
 
     def log_prob(self, X, y, vec=None):
+        compiled = self.__dict__.get('compiled_log_prob', None)
+        if compiled is not None:
+            return compiled(X, y)
+
         if hasattr(self, 'update_distributions'):
             # in case of a hierarchical model, the distributions hyperparam are updated,
             # changing the (conditional) distribution
-            self.update_distributions()
+            self.refresh_distributions()
+
+        if self.analytic_grad and torch.is_grad_enabled():
+            return AnalyticLogProb.apply(self, X, y, *self.parameters())
+        if self.chunked(X, y):
+            return self.chunked_log_prob(X, y)
         return self.my_log_prob(X, y)
 
+    # ANALYTIC GRADIENTS
+    @property
+    def analytic_grad(self):
+        """whether the model provides gradient kernels (analytic_forward,
+        analytic_backward & prior_grad) for its entire log_prob, in which case
+        log_prob bypasses autograd. Set use_analytic_grad = False to disable it."""
+        return False
+
+    @staticmethod
+    def gaussian_log_likelihood_and_grad(mu, y, scale=1.):
+        """:returns td.Normal(mu, scale).log_prob(y).sum() & its gradient wrt. mu"""
+        r = y - mu
+        return Util_Model.gaussian_rss_log_prob(r, scale), r / scale ** 2
+
+    def log_prob_and_grad(self, X, y):
+        """
+        log_prob & its gradients wrt. all parameters from the model's hand derived
+        gradient kernels i.e. a forward & backward pass of the Gaussian
+        likelihood without recording an autograd graph (chunkwise, if chunked).
+        :return: tuple: value, list of gradients aligned with self.parameters()
+        """
+        with torch.no_grad():
+            value = self.prior_log_prob()
+            grads = self.prior_grad()
+            for X, y in (self.chunks(X, y) if self.chunked(X, y) else [(X, y)]):
+                mu, cache = self.analytic_forward(X)
+                v, dmu = self.gaussian_log_likelihood_and_grad(mu, y, self.likelihood_scale)
+                value = value + v
+                for name, g in self.analytic_backward(cache, dmu, input_grad=False)[1].items():
+                    grads[name] = grads.get(name, 0.) + g
+
+        return value, [grads.get(name) for name, _ in self.named_parameters()]
+
+    def compile_log_prob(self, X, y):
+        """
+        opt-in: trace the entire log posterior (update_distributions, prior &
+        likelihood) of this very instance into a single TorchScript graph, which
+        log_prob (and thereby the samplers) use from now on. This removes the
+        python dispatch overhead, that dominates log_prob for small networks.
+
+        Notice, the graph is traced for this model's configuration and
+        dense X, y of the given number of columns. As the traced graph does not
+        execute update_distributions' side effects, call update_distributions
+        before using the distributions (e.g. reset_parameters, plot) after
+        sampling. The compiled graph is not part of the model's state; use
+        decompile_log_prob to return to the eager path.
+
+        :param X: example design (e.g. the first batch)
+        :param y: example response
+        :return: the traced torch.jit.ScriptModule
+        """
+        self.decompile_log_prob()
+        compiled = torch.jit.trace(Log_posterior(self), (X, y), check_trace=False)
+        # not registered as submodule: the model itself is compiled's submodule
+        self.__dict__['compiled_log_prob'] = compiled
+        return compiled
+
+    def decompile_log_prob(self):
+        self.__dict__.pop('compiled_log_prob', None)
+
     def invert_bij(self, name):
         return self.dist[name].transforms[0]._inverse(self.get_param(name))
 
+    # STACKED (MULTI CHAIN) EXECUTION
+    @staticmethod
+    def stack_states(chain):
+        """
+        :param chain: list of K state_dicts
+        :return: dict of the states' tensors, stacked along a new leading chain
+        dimension i.e. of shape (K, *param.shape), which the *_stacked methods
+        (e.g. forward_stacked(X, states)) evaluate in a single batched computation
+        """
+        return {name: torch.stack([state[name] for state in chain]) for name in chain[0]}
+
+    @staticmethod
+    def substates(states, prefix):
+        """the stacked states of a submodule, e.g. substates(states, 'layers.0.')"""
+        return {name[len(prefix):]: v for name, v in states.items() if name.startswith(prefix)}
+
+    def likelihood_stacked(self, *args):
+        """:param args: forward_stacked's arguments i.e. data & stacked states
+        :returns the conditional distribution of y | X for all K states"""
+        return td.Normal(self.forward_stacked(*args), scale=torch.tensor(1.))
+
+    def log_prob_stacked(self, *args):
+        """
+        log_prob of K stacked states (see stack_states) at once
+        :param args: data, y & states i.e. model.log_prob_stacked(X, y, states)
+        :return: Tensor of shape (K, )
+        """
+        *data, y, states = args
+        return self.prior_log_prob_stacked(states) + \
+               self.likelihood_stacked(*data, states).log_prob(y).flatten(1).sum(1)
+
     def _chain_predict(self, chain, *args):
         """
 
@@ -69,11 +418,8 @@ class Util_Model(Util_plots):
 
         d = dict()
         if chain is not None:
-            for i, p in enumerate(chain):
-                # TODO parallelize predictions
-                self.load_state_dict(p)
-                # self.update_distributions()
-                d.update({str(i): self.forward(*args)})
+            for i, f in enumerate(self.forward_stacked(*args, self.stack_states(chain))):
+                d.update({str(i): f})
 
         return d
 
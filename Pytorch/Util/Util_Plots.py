@@ -38,14 +38,14 @@ class Util_plots:
             self.load_state_dict(self.init_model)
             df['init'] = self.forward(*args).view(X.shape[0], ).numpy()
 
-        # predict chain
-        if chain is not None:
-            for i, c in enumerate(chain):
-                self.load_state_dict(c)
-                df[str(i)] = self.forward(*args).view(X.shape[0], ).numpy()
+        # return to current state
+        self.load_state_dict(current)
 
-            # return to current state
-            self.load_state_dict(current)
+        # predict chain: all states in a single batched forward
+        if chain is not None:
+            f = self.forward_stacked(*args, self.stack_states(chain))
+            for i in range(len(chain)):
+                df[str(i)] = f[i].view(X.shape[0], ).numpy()
 
         return df
 
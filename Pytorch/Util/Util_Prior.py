@@ -0,0 +1,340 @@
+import math
+import torch
+import torch.distributions as td
+
+from Pytorch.Util.Util_Distribution import LogTransform
+
+
+class FusedPrior:
+    # family: (names of the distributions' parameters to be stacked)
+    families = {
+        td.Normal: ('loc', 'scale'),
+        td.Uniform: ('low', 'high')}
+
+    # families, whose log density is constant within their support: their
+    # contribution reduces to a constant & a bounds check (see flat_log_prob)
+    flat = (td.Uniform,)
+
+    def __init__(self, params):
+        """
+        Compiled prior representation of parameters with static (non-hierarchical)
+        priors p.distrib. The parameters are grouped by their distribution's
+        family, the distributions' parameters are stacked once into contiguous
+        buffers, such that the prior of all parameters is a single vectorized
+        computation per family instead of one log_prob call per parameter.
+        Parameters of any other family are evaluated by their own distrib.
+
+        Notice, that the distributions are read at construction; if a p.distrib
+        is replaced or altered afterwards, the FusedPrior must be rebuilt.
+
+        :param params: iterable of nn.Parameter, each carrying a .distrib attribute
+        :example:
+        prior = FusedPrior(bnn.parameters())
+        prior.log_prob()  # == sum(p.distrib.log_prob(p).sum() for p in bnn.parameters())
+        """
+        self.groups = {family: [] for family in self.families}
+        self.other = []
+        for p in params:
+            family = type(p.distrib)
+            if family in self.families:
+                self.groups[family].append(p)
+            else:
+                self.other.append(p)
+        self.groups = {family: params for family, params in self.groups.items() if params}
+
+        # stacked distributional parameters (broadcasted to the parameters' shapes)
+        self.buffers = {
+            family: tuple(
+                torch.cat([getattr(p.distrib, name).expand(p.shape).reshape(-1) for p in params]).detach()
+                for name in self.families[family])
+            for family, params in self.groups.items()}
+
+        # constant parts of the log densities
+        self.const = {}
+        if td.Normal in self.groups:
+            loc, scale = self.buffers[td.Normal]
+            self.buffers[td.Normal] = (loc, scale.reciprocal())
+            self.const[td.Normal] = -scale.log().sum() - 0.5 * math.log(2 * math.pi) * scale.nelement()
+        if td.Uniform in self.groups:
+            low, high = self.buffers[td.Uniform]
+            self.const[td.Uniform] = -(high - low).log().sum()
+        self.const_sum = sum(self.const.values(), torch.tensor(0.))
+
+    def stack(self, family):
+        """:returns the flat vector of all parameters of this family"""
+        return torch.cat([p.view(-1) for p in self.groups[family]])
+
+    def log_prob(self):
+        value = self.const_sum
+
+        if td.Normal in self.groups:
+            loc, inv_scale = self.buffers[td.Normal]
+            value = value - 0.5 * (((self.stack(td.Normal) - loc) * inv_scale) ** 2).sum()
+
+        if td.Uniform in self.groups:
+            # constant within the support: log of the support's indicator (0 or -inf)
+            # by a bounds check, which records no autograd graph. It remains a
+            # tensor op, such that compile_log_prob's trace does not freeze it
+            low, high = self.buffers[td.Uniform]
+            with torch.no_grad():
+                w = self.stack(td.Uniform)
+                inside = ((low <= w) & (w < high)).all()
+            value = value + inside.to(value.dtype).log()
+
+        for p in self.other:
+            value = value + p.distrib.log_prob(p).sum()
+
+        return value
+
+
+# FUNCTIONAL PRIORS ------------------------------------------------------------
+# pure tensor functions of the log densities, that do not require any
+# (mutated) torch.distributions objects. They replicate the respective
+# td.Distribution.log_prob (without argument validation)
+_LOG_SQRT_2PI = 0.5 * math.log(2 * math.pi)
+
+
+def normal_log_prob(x, loc=0., scale=1.):
+    """:param loc, scale: Tensor or float"""
+    if isinstance(scale, float):
+        return -((x - loc) ** 2) / (2 * scale ** 2) - math.log(scale) - _LOG_SQRT_2PI
+    return -((x - loc) ** 2) / (2 * scale ** 2) - torch.log(scale) - _LOG_SQRT_2PI
+
+
+def normal_log_prob_log_scale(x, log_scale):
+    """N(0, exp(log_scale)) log density; avoids the exp/log roundtrip of
+    bijected scale parameters"""
+    return -0.5 * x ** 2 * torch.exp(-2 * log_scale) - log_scale - _LOG_SQRT_2PI
+
+
+def gamma_log_prob(x, concentration, rate):
+    """:param concentration: float. :param rate: Tensor"""
+    return concentration * torch.log(rate) + (concentration - 1) * torch.log(x) - \
+           rate * x - math.lgamma(concentration)
+
+
+def halfcauchy_log_prob(x, scale=1.):
+    """:param scale: float"""
+    value = math.log(2 / (math.pi * scale)) - torch.log1p((x / scale) ** 2)
+    return value.masked_fill(x < 0, -math.inf)
+
+
+def log_bijected(log_prob, y, *args):
+    """
+    log density of y = log(x), x ~ log_prob(x, *args) exactly as
+    td.TransformedDistribution(dist, LogTransform()).log_prob(y) evaluates it;
+    i.e. including LogTransform's jacobian term.
+    """
+    x = y.exp()
+    return log_prob(x, *args) - LogTransform().log_abs_det_jacobian(x, y)
+
+
+def _sum(x, chains=False):
+    """sum all elements or (if chains) all but the leading chain dimension"""
+    return x.reshape(x.shape[0], -1).sum(1) if chains else x.sum()
+
+
+def group_lasso_log_prob(W, W_shrinked, tau, lamb, m, bijected=True, chains=False):
+    """
+    Group_lasso prior: tau ~ Ga((m + 1) / 2, lamb² / 2), W_shrinked ~ N(0, tau), W ~ N(0, 1)
+    :param m: group size
+    :param bijected: bool. whether tau & lamb are on log scale
+    :param chains: bool. whether all tensors carry a leading chain dimension
+    (see Util_Model.stack_states), in which case the log density is returned
+    per chain; the hyperparameters must broadcast against the weights.
+    """
+    if bijected:
+        rate = torch.exp(2 * lamb) / 2
+        value = _sum(log_bijected(gamma_log_prob, tau, (m + 1) / 2, rate), chains) + \
+                _sum(normal_log_prob_log_scale(W_shrinked, tau), chains)
+    else:
+        value = _sum(gamma_log_prob(tau, (m + 1) / 2, lamb ** 2 / 2), chains) + \
+                _sum(normal_log_prob(W_shrinked, scale=tau), chains)
+    return value + _sum(normal_log_prob(W), chains)
+
+
+def group_horseshoe_log_prob(W, W_shrinked, tau, bijected=True, chains=False):
+    """
+    Group_HorseShoe prior: tau ~ C+(0, 1), W_shrinked ~ N(0, tau²), W ~ N(0, 1)
+    where the bijected version (for historic reasons) uses W_shrinked ~ N(0, tau)
+    """
+    if bijected:
+        value = _sum(log_bijected(halfcauchy_log_prob, tau), chains) + \
+                _sum(normal_log_prob_log_scale(W_shrinked, tau), chains)
+    else:
+        value = _sum(halfcauchy_log_prob(tau), chains) + \
+                _sum(normal_log_prob(W_shrinked, scale=tau ** 2), chains)
+    return value + _sum(normal_log_prob(W), chains)
+
+
+def group_horseshoe_nc_log_prob(W, W_raw, tau, bijected=True, chains=False):
+    """
+    non-centered Group_HorseShoe prior: tau ~ C+(0, 1), W_raw ~ N(0, 1), W ~ N(0, 1)
+    where W_shrinked = scale(tau) * W_raw is deterministic (see Group_HorseShoe_NC)
+    """
+    if bijected:
+        value = _sum(log_bijected(halfcauchy_log_prob, tau), chains)
+    else:
+        value = _sum(halfcauchy_log_prob(tau), chains)
+    return value + _sum(normal_log_prob(W_raw), chains) + _sum(normal_log_prob(W), chains)
+
+
+def hierarchical_group_lasso_log_prob(W_shrinked, b, tau, lamb, m, bijected=True, chains=False):
+    """
+    Hierarchical_Group_lasso prior: lamb ~ C+(0, 1), tau_j ~ Ga((m + 1) / 2, lamb² / 2),
+    W_shrinked[j] ~ N(0, tau_j), b ~ N(0, 1)
+    """
+    conc = (m + 1) / 2
+    if bijected:
+        value = _sum(log_bijected(halfcauchy_log_prob, lamb), chains) + \
+                _sum(log_bijected(gamma_log_prob, tau, conc, torch.exp(2 * lamb) / 2), chains) + \
+                _sum(normal_log_prob_log_scale(W_shrinked.transpose(-1, -2), tau), chains)
+    else:
+        value = _sum(halfcauchy_log_prob(lamb), chains) + \
+                _sum(gamma_log_prob(tau, conc, lamb ** 2 / 2), chains) + \
+                _sum(normal_log_prob(W_shrinked.transpose(-1, -2), scale=tau), chains)
+    if b is not None:
+        value = value + _sum(normal_log_prob(b), chains)
+    return value
+
+
+def hierarchical_group_horseshoe_log_prob(W_shrinked, b, tau, lamb, bijected=True, chains=False):
+    """
+    Hierarchical_Group_HorseShoe prior: lamb ~ C+(0, 1), tau_j ~ C+(0, 1),
+    W_shrinked[j] ~ N(0, tau_j² lamb), b ~ N(0, 1)
+    """
+    if bijected:
+        value = _sum(log_bijected(halfcauchy_log_prob, lamb), chains) + \
+                _sum(log_bijected(halfcauchy_log_prob, tau), chains) + \
+                _sum(normal_log_prob_log_scale(W_shrinked.transpose(-1, -2), 2 * tau + lamb), chains)
+    else:
+        value = _sum(halfcauchy_log_prob(lamb), chains) + _sum(halfcauchy_log_prob(tau), chains) + \
+                _sum(normal_log_prob(W_shrinked.transpose(-1, -2), scale=tau ** 2 * lamb), chains)
+    if b is not None:
+        value = value + _sum(normal_log_prob(b), chains)
+    return value
+
+
+def hierarchical_group_horseshoe_nc_log_prob(W_raw, b, tau, lamb, bijected=True, chains=False):
+    """
+    non-centered Hierarchical_Group_HorseShoe prior: lamb ~ C+(0, 1), tau_j ~ C+(0, 1),
+    W_raw ~ N(0, 1), b ~ N(0, 1) where W_shrinked[j] = tau_j² lamb W_raw[j]
+    """
+    if bijected:
+        value = _sum(log_bijected(halfcauchy_log_prob, lamb), chains) + \
+                _sum(log_bijected(halfcauchy_log_prob, tau), chains)
+    else:
+        value = _sum(halfcauchy_log_prob(lamb), chains) + _sum(halfcauchy_log_prob(tau), chains)
+    value = value + _sum(normal_log_prob(W_raw), chains)
+    if b is not None:
+        value = value + _sum(normal_log_prob(b), chains)
+    return value
+
+
+# ANALYTIC GRADIENTS -----------------------------------------------------------
+# hand derived d/dx of the above log densities, which the models' gradient
+# kernels (see Util_Model.log_prob_and_grad) combine to bypass autograd
+def normal_grad(x, loc=0., scale=1.):
+    return -(x - loc) / scale ** 2
+
+
+def normal_scale_grad(x, scale):
+    """d/dscale of normal_log_prob(x, scale=scale)"""
+    return x ** 2 / scale ** 3 - 1 / scale
+
+
+def normal_log_scale_grad(x, log_scale):
+    """d/dlog_scale of normal_log_prob_log_scale(x, log_scale)"""
+    return x ** 2 * torch.exp(-2 * log_scale) - 1
+
+
+def gamma_grad(x, concentration, rate):
+    return (concentration - 1) / x - rate
+
+
+def halfcauchy_grad(x, scale=1.):
+    return -2 * x / (scale ** 2 + x ** 2)
+
+
+def bijected_grad(grad, y, *args):
+    """d/dy of log_bijected(log_prob, y, *args) given grad = d/dx log_prob;
+    notice, that LogTransform's jacobian term -1/x contributes 1/x"""
+    x = y.exp()
+    return grad(x, *args) * x + 1 / x
+
+
+def flat_log_prob(dist, x):
+    """
+    dist.log_prob(x).sum() of a prior, which is constant within its support
+    (see FusedPrior.flat): the log normalizer (cached on the static distribution)
+    and a bounds check, which records no autograd graph
+    """
+    const = dist.__dict__.get('flat_const', None)
+    if const is None:
+        const = dist.flat_const = -torch.log(dist.high - dist.low).expand(x.shape).sum().detach()
+    with torch.no_grad():
+        inside = ((dist.low <= x) & (x < dist.high)).all()
+    return const + inside.to(const.dtype).log()  # log indicator: traceable (see FusedPrior)
+
+
+def static_grad(dist, x):
+    """d/dx dist.log_prob(x) of a static prior (see FusedPrior.families)"""
+    if type(dist) is td.Normal:
+        return normal_grad(x, dist.loc, dist.scale)
+    elif type(dist) is td.Uniform:
+        return torch.zeros_like(x)  # almost everywhere
+    raise NotImplementedError('no gradient kernel for {}'.format(type(dist).__name__))
+
+
+def group_lasso_grad(W, W_shrinked, tau, lamb, m, bijected=True):
+    """:returns the gradients of group_lasso_log_prob wrt. (W, W_shrinked, tau)"""
+    conc = (m + 1) / 2
+    if bijected:
+        g_shrinked = -W_shrinked * torch.exp(-2 * tau)
+        g_tau = bijected_grad(gamma_grad, tau, conc, torch.exp(2 * lamb) / 2) + \
+                normal_log_scale_grad(W_shrinked, tau).sum()
+    else:
+        g_shrinked = normal_grad(W_shrinked, scale=tau)
+        g_tau = gamma_grad(tau, conc, lamb ** 2 / 2) + normal_scale_grad(W_shrinked, tau).sum()
+    return normal_grad(W), g_shrinked, g_tau.sum_to_size(tau.shape)
+
+
+def group_horseshoe_grad(W, W_shrinked, tau, bijected=True):
+    """:returns the gradients of group_horseshoe_log_prob wrt. (W, W_shrinked, tau)"""
+    if bijected:
+        g_shrinked = -W_shrinked * torch.exp(-2 * tau)
+        g_tau = bijected_grad(halfcauchy_grad, tau) + normal_log_scale_grad(W_shrinked, tau).sum()
+    else:
+        scale = tau ** 2
+        g_shrinked = normal_grad(W_shrinked, scale=scale)
+        g_tau = halfcauchy_grad(tau) + normal_scale_grad(W_shrinked, scale).sum() * 2 * tau
+    return normal_grad(W), g_shrinked, g_tau.sum_to_size(tau.shape)
+
+
+def group_horseshoe_nc_grad(W, W_raw, tau, bijected=True):
+    """:returns the gradients of group_horseshoe_nc_log_prob wrt. (W, W_raw, tau)"""
+    g_tau = bijected_grad(halfcauchy_grad, tau) if bijected else halfcauchy_grad(tau)
+    return normal_grad(W), normal_grad(W_raw), g_tau
+
+
+if __name__ == '__main__':
+    # benchmark: functional prior vs. update_distributions & td.Distribution.log_prob
+    # (forward & backward as in a sampler step)
+    from timeit import timeit
+    from Pytorch.Layer.Group_lasso import Group_lasso
+    from Pytorch.Layer.Group_HorseShoe import Group_HorseShoe
+    from Pytorch.Layer.Hierarchical_Group_lasso import Hierarchical_Group_lasso
+    from Pytorch.Layer.Hierarchical_Group_HorseShoe import Hierarchical_Group_HorseShoe
+
+    def step(layer):
+        if not layer.functional_prior:
+            layer.update_distributions()
+        layer.prior_log_prob().backward()
+
+    for L in (Group_lasso, Group_HorseShoe, Hierarchical_Group_lasso, Hierarchical_Group_HorseShoe):
+        layer = L(2, 10, bias=True, bijected=True)
+        times = []
+        for functional in (False, True):
+            layer.functional_prior = functional
+            times.append(timeit(lambda: step(layer), number=2000) / 2000 * 1e6)
+        print('{}: distributions {:.1f} us, functional {:.1f} us'.format(L.__name__, *times))
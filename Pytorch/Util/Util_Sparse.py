@@ -0,0 +1,60 @@
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+def to_sparse_tensor(Z, dtype=torch.float32):
+    """
+    convert a scipy.sparse matrix (e.g. the csr design from
+    get_design(..., sparse=True)) to a torch.sparse_coo_tensor
+
+    :param Z: scipy.sparse matrix
+    :param dtype: torch dtype of the values
+    :return: torch.sparse_coo_tensor of shape Z.shape
+    """
+    Z = Z.tocoo()
+    indices = torch.tensor(np.stack([Z.row, Z.col]), dtype=torch.long)
+    values = torch.tensor(Z.data, dtype=dtype)
+    return torch.sparse_coo_tensor(indices, values, size=Z.shape).coalesce()
+
+
+def is_sparse(X):
+    """:returns bool: whether X is a torch sparse tensor (COO or CSR)"""
+    return X.layout != torch.strided
+
+
+class SparseTensorDataset(Dataset):
+    def __init__(self, *tensors):
+        """
+        TensorDataset equivalent, that allows some of the tensors to be
+        scipy.sparse matrices (e.g. a sparse bspline design matrix Z).
+        Since the default collate function stacks the single observations,
+        which is not available for sparse tensors, the dataset yields indices
+        and batches the rows in self.collate. Sparse matrices are sliced
+        rowwise in csr format and converted to torch.sparse_coo_tensor batches.
+
+        :param tensors: torch.Tensor or scipy.sparse matrices; all of the same
+        first dimension.
+
+        :example:
+        trainset = SparseTensorDataset(get_design(X, 2, 20, sparse=True), y)
+        trainloader = DataLoader(trainset, batch_size=100, shuffle=True,
+                                 collate_fn=trainset.collate)
+        """
+        if any(t.shape[0] != tensors[0].shape[0] for t in tensors):
+            raise ValueError('Size mismatch between tensors')
+
+        self.tensors = tuple(t if isinstance(t, torch.Tensor) else t.tocsr()
+                             for t in tensors)
+
+    def __getitem__(self, index):
+        return index
+
+    def __len__(self):
+        return self.tensors[0].shape[0]
+
+    def collate(self, indices):
+        index = np.array(indices)
+        return tuple(t[torch.from_numpy(index)] if isinstance(t, torch.Tensor)
+                     else to_sparse_tensor(t[index])
+                     for t in self.tensors)
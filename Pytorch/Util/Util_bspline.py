@@ -1,6 +1,9 @@
 import numpy as np
 from scipy.interpolate import BSpline
-from collections import deque
+from scipy.special import comb
+from scipy.sparse import diags, csr_matrix
+from scipy.linalg import eig_banded
+from collections import deque, OrderedDict
 
 
 # CONSIDER: def fnc: Recursive Bspline Definiton, returning a callable,
@@ -47,19 +50,16 @@ def eval_basis(x, knots=np.arange(0, 20, 1), degree=2):
     return np.nan_to_num(z)
 
 
-def get_design(X, degree, no_basis):
+def get_knots(X, degree, no_basis):
     """
-    Broadcast eval_basis to a 1dim array X, to obtain the corresponding
-    Designmatrix Z in Basis representation
+    Equidistant knot vector spanned on the support of X, such that the
+    BSpline basis on it has exactly no_basis basis functions.
 
-    :param X:
-    :param degree:
+    :param X: 1dim ndarray
+    :param degree: Basis degree (see eval_basis)
     :param no_basis: number of basis functions (dim of gamma)
-    :return:
-
-    # consider eval_basis decorator - to ensure, The callable Basis Vector is caluclated only once
+    :return: ndarray of knots
     """
-
     # construct degree and X's support dependent number of outer knots
     # FIXME: +-1 is not reasoned!, but introduced to make rowsum Z == 1
     l_knot = X.min() - 1  # - degree - 1
@@ -71,40 +71,249 @@ def get_design(X, degree, no_basis):
 
     h = (u_knot - l_knot) / no_inner_knots
 
-    knots = np.linspace(l_knot - 2 * h, u_knot + 2 * h, num=total_no_knots + 1)
-    # num_basis = knots.shape[0] - (degree + 2)
+    return np.linspace(l_knot - 2 * h, u_knot + 2 * h, num=total_no_knots + 1)
 
-    # obtain designmatrix
-    Z = np.zeros((X.__len__(), no_basis))
-    for i, obs in enumerate(X):
-        Z[i, :] = eval_basis(obs, knots=knots, degree=degree)
 
+def eval_design(X, knots, degree, sparse=False):
+    """
+    Vectorized Cox-de Boor evaluation of the BSpline basis spanned on knots for
+    all observations in X at once. Produces the same basis as eval_basis, i.e.
+    the basis elements on the moving windows of length degree + 3 (which are
+    splines of order degree + 1), but only ever evaluates the degree + 2
+    basis functions, that are non-zero in the knot span of each observation.
+
+    :param X: 1dim ndarray of observations
+    :param knots: ndarray of knots (e.g. from get_knots)
+    :param degree: Basis degree (see eval_basis)
+    :param sparse: bool. if True, a scipy.sparse.csr_matrix is returned
+    instead of a dense ndarray
+    :return: Designmatrix Z of shape (len(X), len(knots) - degree - 2)
+    """
+    X = np.asarray(X, dtype=np.float64).reshape(-1)
+    knots = np.asarray(knots, dtype=np.float64)
+    k = degree + 1  # order of the basis elements
+    no_basis = len(knots) - k - 1
+
+    # pad k equidistant knots on both ends, such that the recursion is
+    # well defined in the outer spans. The padded knots support only basis
+    # functions, which are dropped below
+    h_l, h_u = knots[1] - knots[0], knots[-1] - knots[-2]
+    knots = np.concatenate([knots[0] - h_l * np.arange(k, 0, -1),
+                            knots,
+                            knots[-1] + h_u * np.arange(1, k + 1)])
+
+    # knot span of each x: knots[i] <= x < knots[i + 1]
+    span = np.clip(np.searchsorted(knots, X, side='right') - 1, k, len(knots) - k - 2)
+
+    # Cox-de Boor recursion on the k + 1 non-zero basis functions in the span
+    # (algorithm A2.2 in Piegl & Tiller: The NURBS Book)
+    N = np.zeros((len(X), k + 1))
+    N[:, 0] = 1.
+    left = np.zeros((len(X), k + 1))
+    right = np.zeros((len(X), k + 1))
+    for j in range(1, k + 1):
+        left[:, j] = X - knots[span + 1 - j]
+        right[:, j] = knots[span + j] - X
+        saved = np.zeros(len(X))
+        for r in range(j):
+            temp = N[:, r] / (right[:, r + 1] + left[:, j - r])
+            N[:, r] = saved + right[:, r + 1] * temp
+            saved = left[:, j - r] * temp
+        N[:, j] = saved
+
+    # basis function i - k + r is the r-th non-zero function in span i
+    # (shifted by the k padded knots)
+    cols = span[:, None] - 2 * k + np.arange(k + 1)[None, :]
+    rows = np.repeat(np.arange(len(X)), k + 1).reshape(len(X), k + 1)
+
+    # observations outside of the knots' support (extrapolate=False) are zero
+    inside = ((X >= knots[k]) & (X <= knots[-k - 1]))[:, None]
+    valid = (cols >= 0) & (cols < no_basis) & inside
+    N = np.where(valid, N, 0.)
+
+    if sparse:
+        return csr_matrix((N[valid], (rows[valid], cols[valid])), shape=(len(X), no_basis))
+
+    Z = np.zeros((len(X), no_basis))
+    Z[rows[valid], cols[valid]] = N[valid]
     return Z
 
 
-def diff_mat1D(dim, order=1):
+def get_design(X, degree, no_basis, sparse=False):
+    """
+    Broadcast eval_basis to a 1dim array X, to obtain the corresponding
+    Designmatrix Z in Basis representation. The basis is evaluated for all
+    observations at once (see eval_design).
+
+    :param X:
+    :param degree:
+    :param no_basis: number of basis functions (dim of gamma)
+    :param sparse: bool. if True, Z is returned as scipy.sparse.csr_matrix
+    :return:
+    """
+    knots = get_knots(X, degree, no_basis)
+
+    return eval_design(X, knots=knots, degree=degree, sparse=sparse)
+
+
+def get_design_stacked(X, degree, no_basis):
+    """
+    Stacked designs of all columns of a (n, p) array X, e.g. for p smooth
+    terms in an additive model (see Layer.GAM_additive) or the marginal
+    designs of a tensor product basis (see get_design2D).
+
+    :param X: ndarray of shape (n, p)
+    :param degree: Basis degree (see eval_basis)
+    :param no_basis: number of basis functions per column
+    :return: ndarray of shape (n, p, no_basis)
+    """
+    return np.stack([get_design(X[:, j], degree, no_basis) for j in range(X.shape[1])], axis=1)
+
+
+def get_design2D(X, degree, no_basis):
+    """
+    Marginal designs of a tensor product bspline basis on a (n, 2) array X.
+    The tensor product design is the rowwise kronecker product
+    Z[i, a * no_basis + b] = Z1[i, a] * Z2[i, b], which is not materialized.
+
+    :param X: ndarray of shape (n, 2)
+    :param degree: Basis degree (see eval_basis)
+    :param no_basis: number of basis functions per axis
+    :return: ndarray of shape (n, 2, no_basis), stacking Z1 and Z2
+    """
+    return get_design_stacked(X[:, :2], degree, no_basis)
+
+
+class BasisTransformer:
+    def __init__(self, degree=2, no_basis=20, cache_size=8):
+        """
+        Stateful BSpline basis expansion: the knots are fixed once on the
+        training data (fit), such that all subsequent designs (validation,
+        plotting, continuation runs) share the same basis functions.
+        Designs of recently transformed arrays are kept in a LRU cache, keyed
+        on the array's content hash.
+
+        :param degree: Basis degree (see eval_basis)
+        :param no_basis: number of basis functions (dim of gamma)
+        :param cache_size: number of designs kept in the cache
+
+        :example:
+        basis = BasisTransformer(degree=2, no_basis=20).fit(X)
+        Z, Z_val = basis.transform(X), basis.transform(X_val)
+        """
+        self.degree = degree
+        self.no_basis = no_basis
+        self.cache_size = cache_size
+        self.knots = None
+        self._cache = OrderedDict()
+
+    def fit(self, X):
+        """fix the knots on the support of X"""
+        self.knots = get_knots(np.asarray(X), self.degree, self.no_basis)
+        self._cache.clear()
+        return self
+
+    def transform(self, X, sparse=False):
+        """
+        :param X: 1dim ndarray
+        :param sparse: bool. if True, Z is returned as scipy.sparse.csr_matrix
+        :return: Designmatrix Z of X on the fitted knots. Notice, that
+        cached designs are returned, not copies of them.
+        """
+        if self.knots is None:
+            raise RuntimeError('BasisTransformer must be fitted before transform')
+
+        X = np.ascontiguousarray(X)
+        key = hash((X.tobytes(), X.shape, X.dtype.str, sparse))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        Z = eval_design(X, knots=self.knots, degree=self.degree, sparse=sparse)
+
+        self._cache[key] = Z
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return Z
+
+    def transform_chunks(self, X, chunk_size=10000, sparse=False):
+        """
+        generator of the design of X in consecutive chunks of rows, such that
+        the full (len(X), no_basis) design is never allocated. Chunks bypass
+        the cache.
+
+        :param X: 1dim ndarray
+        :param chunk_size: number of rows per chunk
+        :param sparse: bool. if True, the chunks are scipy.sparse.csr_matrix
+        """
+        if self.knots is None:
+            raise RuntimeError('BasisTransformer must be fitted before transform')
+
+        for i in range(0, len(X), chunk_size):
+            yield eval_design(X[i:i + chunk_size], knots=self.knots, degree=self.degree, sparse=sparse)
+
+    def fit_transform(self, X, sparse=False):
+        return self.fit(X).transform(X, sparse)
+
+    def state_dict(self):
+        return {'degree': self.degree, 'no_basis': self.no_basis, 'knots': self.knots}
+
+    def load_state_dict(self, state_dict):
+        self.degree = state_dict['degree']
+        self.no_basis = state_dict['no_basis']
+        self.knots = state_dict['knots']
+        self._cache.clear()
+        return self
+
+
+def diff_coef(order=1):
+    """
+    coefficients of the difference operator of order r, i.e. the non-zero
+    entries of each row of diff_mat1D(dim, r)[0]:
+    (D_r gamma)_i = sum_j (-1)^(r - j) binom(r, j) gamma_(i + j)
+
+    :param order: difference order
+    :return: ndarray of length order + 1
+    """
+    return np.array([(-1.) ** (order - j) * comb(order, j) for j in range(order + 1)])
+
+
+def diff_mat1D(dim, order=1, sparse=False):
     """
     :param dim: the dimension of gamma vector (i.e. number of basis dimensions)
-    :param order: difference order D_r = D_1 [:-r-1, :-r-1] @ D_r-1
+    :param order: difference order. D_r is built directly from the binomial
+    coefficients on its order + 1 diagonals (see diff_coef) and equals
+    D_r = D_1 [:-r-1, :-r-1] @ D_r-1
+    :param sparse: bool. if True, D and K are returned as scipy.sparse.csr_matrix
+    (banded with bandwidth order), otherwise as dense ndarrays
     :return: tupel: difference matrix of order,
     difference penalty matric of this order
     """
-    # first order difference matrix: shape: (dim-1) x (dim)
-    d1 = np.diag(np.repeat(-1, dim), k=0) + np.diag(np.repeat(1, dim - 1), k=1)
-    d1 = d1[:-1, :]
+    # difference matrix: shape: (dim - order) x (dim)
+    dr = diags(diff_coef(order), offsets=np.arange(order + 1), shape=(dim - order, dim), format='csr')
+    K = (dr.T @ dr).tocsr()
+
+    if sparse:
+        return dr, K
+    return dr.toarray(), K.toarray()
 
-    # d1.shape == (dim - 1, dim)
 
-    # higher order difference matrices
-    r = 1
-    dr = d1
-    while r < order:
-        dr = d1[:-r, :-r].dot(dr)
-        r += 1
-        # dr.shape == (dim - r, dim)
+def banded_eigh(K, order=1):
+    """
+    eigen decomposition of the symmetric penalty K of bandwidth order without
+    densifying K: only its order + 1 lower diagonals are passed to the banded
+    eigen solver.
 
-    K = dr.T.dot(dr)
-    return dr, K
+    :param K: scipy.sparse matrix (or ndarray), e.g. diff_mat1D(dim, order, sparse=True)[1]
+    :param order: bandwidth of K
+    :return: tuple: ascending eigenvalues, eigenvectors (columns)
+    """
+    K = csr_matrix(K)
+    dim = K.shape[0]
+    ab = np.zeros((order + 1, dim))
+    for i in range(order + 1):
+        ab[i, :dim - i] = K.diagonal(-i)
+    return eig_banded(ab, lower=True)
 
 
 def diff_mat2D(dim):